@@ -19,9 +19,16 @@
 # The PyVuka data buffer matrix is a list of object_buffer dictionaries
 #
 #######################################################################################################################
-from .. import commands, plot, data_obj   
+from .. import commands, plot, data_obj, fitfxns
 from PIL import Image
 from io import BytesIO as BIO
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import asyncio
+import threading
+import copy
+import re
+import sys
 import os
 
 
@@ -33,10 +40,77 @@ class new_instance:
     def __init__(self):
         self.data = data_obj.init()
         self.plot = plot.plotter(self.data)
+        self.fit_pool = fitfxns.FitPool()
+        self.fit_cache = fitfxns.FitCache()
+        self.fit_telemetry = fitfxns.FitTelemetry()
+        self.__job_executor = None
+        self.__job_pool = None
 
     def clear_all(self):
         self.data = data_obj.init()
 
+    def close(self):
+        if self.__job_executor is not None:
+            self.__job_executor.shutdown(wait=True, cancel_futures=True)
+            self.__job_executor = None
+        if self.__job_pool is not None:
+            self.__job_pool.close()
+        self.fit_pool.close()
+
+    def submit_fit(self, first_buffer=None, last_buffer=None, fit_options='', apply_results=True):
+        """Starts 'fit <fit_options>' over buffers first_buffer..last_buffer (default: all) in the background and
+        returns a FitJob.  The job fits copies of the buffers taken now, so the data matrix can be read and edited
+        while it runs; with apply_results the fit, model and residuals of those buffers are replaced when it
+        finishes, otherwise call FitJob.apply().  Jobs run one at a time, in submission order.  Raises ValueError if a
+        parameter link refers to a buffer outside the range; a fit that does not run raises from FitJob.result()"""
+        length = self.data.matrix.length()
+        first_buffer = 1 if first_buffer is None else int(first_buffer)
+        last_buffer = length if last_buffer is None else int(last_buffer)
+        if not 1 <= first_buffer <= last_buffer <= length:
+            raise ValueError('Supplied buffer range is invalid!')
+        if not isinstance(fit_options, str):
+            raise ValueError(f'Fit options are not a valid string object!')
+        job = FitJob(self, [self.data.matrix.buffer(i) for i in range(first_buffer, last_buffer + 1)],
+                     first_buffer, fit_options, apply_results)
+        if self.__job_executor is None:
+            # one job thread and one worker pool shared by all jobs, separate from the pool used by run_pyvuka_command
+            self.__job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pyvuka-fit')
+            self.__job_pool = fitfxns.FitPool()
+        job._start(self.__job_executor, self.__job_pool)
+        return job
+
+    def get_fit_cache_stats(self):
+        return self.fit_cache.stats()
+
+    def set_fit_cache_file(self, cache_file_path):
+        self.fit_cache.set_path(cache_file_path)
+        return self.fit_cache.stats()
+
+    def clear_fit_cache(self):
+        self.fit_cache.clear()
+        return self.fit_cache.stats()
+
+    def get_fit_telemetry(self, **filters):
+        """Per group records of the fits run in this session, e.g. get_fit_telemetry(buffers=3, fit=2)"""
+        return self.fit_telemetry.records(**filters)
+
+    def get_fit_telemetry_summary(self, by='function', **filters):
+        return self.fit_telemetry.summary(by, **filters)
+
+    def export_fit_telemetry(self, output_file_path, **filters):
+        """Writes the fit records as CSV if output_file_path ends in .csv, otherwise as JSON"""
+        if output_file_path.lower().endswith('.csv'):
+            self.fit_telemetry.to_csv(output_file_path, **filters)
+        else:
+            self.fit_telemetry.to_json(output_file_path, **filters)
+        return output_file_path
+
+    def clear_fit_telemetry(self):
+        self.fit_telemetry.clear()
+
+    def verify_fit_precision(self, fxn_indices=None):
+        return fitfxns.verify_precision(fxn_indices)
+
     def new_datamatrix(self):
         return self.data.new_matrix()
 
@@ -215,3 +289,178 @@ class new_instance:
             return commands.Command(self)(native_pyvuka_command)
         except Exception as e:
             raise ValueError(f'Invalid PyVuka command!\n\t{str(e)}')
+
+
+class _ThreadOutput(object):
+    """sys.stdout stand-in, installed only while fit jobs run, that sends what fit job threads print to their job
+    log and everything else on"""
+    lock = threading.Lock()
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.targets = {}
+
+    def write(self, text):
+        return self.targets.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.targets.get(threading.get_ident(), self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @classmethod
+    def redirect(cls, target):
+        """Sends what the calling thread prints to target until restore() is called"""
+        with cls.lock:
+            if not isinstance(sys.stdout, cls):
+                sys.stdout = cls(sys.stdout)
+            sys.stdout.targets[threading.get_ident()] = target
+            return sys.stdout
+
+    def restore(self):
+        """Stops redirecting the calling thread.  Once no thread is redirected the original stream is put back,
+        unless sys.stdout has been replaced in the meantime"""
+        with _ThreadOutput.lock:
+            self.targets.pop(threading.get_ident(), None)
+            if len(self.targets) == 0 and sys.stdout is self:
+                sys.stdout = self.stream
+
+
+class FitJob(object):
+    """Handle of a background fit started by new_instance.submit_fit.  Poll progress and partial_results(), stop it
+    with cancel(), wait with result() or 'await job' from asyncio.  Cancelling takes effect between groups (between
+    iterations with -batch, between starts with -multistart); a cancelled job leaves the data matrix untouched and
+    waiting on it raises CancelledError"""
+    def __init__(self, session, buffers, first_buffer, fit_options, apply_results):
+        self.command = f'fit {fit_options}'.strip()
+        self.first_buffer = first_buffer
+        self.last_buffer = first_buffer + len(buffers) - 1
+        self.apply_results = apply_results
+        self.__buffers = buffers
+        self.__applied = False
+        self.__future = None
+        self.__lock = threading.Lock()
+        self.__cancel = threading.Event()
+        self.__finished = set()
+        self.__total = 0
+        self.__partial = {}
+        self.__log = StringIO()
+        # the job's own session holds copies of the buffers and shares the fit cache; it has no plotter
+        self.__session = new_instance.__new__(new_instance)
+        self.__session.data = data_obj.init()
+        self.__session.data.directories = copy.deepcopy(session.data.directories)
+        # the copies are numbered from 1, so parameter names in links (<param>_<n>_<buffer>) are renumbered to match
+        for buffer in buffers:
+            for link in buffer.fit.link.get():
+                if link is not None and any(not first_buffer <= int(k) <= self.last_buffer
+                                            for k in re.findall(r'_\d+_(\d+)\b', link)):
+                    raise ValueError(f'Parameter link {link} refers to a buffer outside the fit range!')
+            copied = copy.deepcopy(buffer)
+            copied.fit.link.set(FitJob.renumber_links(copied.fit.link.get(), 1 - first_buffer))
+            self.__session.data.matrix.add_buffer(copied)
+        self.__session.plot = None
+        self.__session.fit_cache = session.fit_cache
+        self.__session.fit_telemetry = session.fit_telemetry
+        self.__session.fit_progress = self.__progress
+
+    @staticmethod
+    def renumber_links(links, offset):
+        """Shifts the buffer number of every parameter name (<param>_<n>_<buffer>) in links by offset"""
+        return [None if link is None else
+                re.sub(r'\b([A-Za-z_]\w*_\d+_)(\d+)\b', lambda t: t.group(1) + str(int(t.group(2)) + offset), link)
+                for link in links]
+
+    def _start(self, executor, pool):
+        self.__session.fit_pool = pool
+        self.__future = executor.submit(self.__run)
+
+    def __run(self):
+        if self.__cancel.is_set():
+            raise CancelledError()
+        output = _ThreadOutput.redirect(self.__log)
+        try:
+            message = commands.Command(self.__session)(self.command)
+        except fitfxns.FitCancelled:
+            raise CancelledError()
+        finally:
+            output.restore()
+        if not str(message).endswith('Fitting Complete!'):
+            # fit returns its error message, e.g. an invalid linking scheme, without fitting
+            raise RuntimeError(str(message).strip())
+        with self.__lock:
+            self.__finished = set(range(self.__total))
+        if self.apply_results:
+            self.__copy_back()
+        return message
+
+    def __progress(self, param_dict, idx_list, results):
+        group = param_dict['group']
+        with self.__lock:
+            self.__total = param_dict.get('total_groups', len(param_dict['plan_vec']))
+            for idx, result in zip(idx_list, results):
+                n = param_dict['group_index'][idx] if 'group_index' in param_dict else idx
+                self.__finished.add(n)
+                for j, names in enumerate(param_dict['param_id_vec'][idx]):
+                    buffer = param_dict['bmin'] + n * group + j
+                    self.__partial[self.first_buffer + buffer - 1] = None if result is None or result.aborted else {
+                        'parameters': [result.params[name].value for name in names],
+                        'errors': [result.params[name].stderr for name in names],
+                        'chisqr': result.chisqr, 'success': result.success}
+        if self.__cancel.is_set():
+            raise fitfxns.FitCancelled()
+
+    @property
+    def progress(self):
+        """(groups finished, total groups); (0, 0) until the first group finishes"""
+        with self.__lock:
+            return len(self.__finished), self.__total
+
+    @property
+    def log(self):
+        return self.__log.getvalue()
+
+    def partial_results(self):
+        """{buffer number: {'parameters', 'errors', 'chisqr', 'success'}} for every buffer fit so far, None if its
+        fit failed.  Buffer numbers are those of the data matrix the job was submitted from"""
+        with self.__lock:
+            return copy.deepcopy(self.__partial)
+
+    def apply(self):
+        """Copies the fit, model and residuals of the finished job onto the buffers it was submitted for"""
+        if not self.__future.done() or self.__future.cancelled() or self.__future.exception() is not None:
+            raise RuntimeError('Fit job has not completed!')
+        self.__copy_back()
+        return self.__buffers
+
+    def __copy_back(self):
+        with self.__lock:
+            if not self.__applied:
+                # whole attributes are swapped, so a reader sees either the old or the new fit of a buffer
+                for n, buffer in enumerate(self.__buffers):
+                    fitted = self.__session.data.matrix.buffer(n + 1)
+                    fitted.fit.link.set(FitJob.renumber_links(fitted.fit.link.get(), self.first_buffer - 1))
+                    buffer.fit, buffer.model, buffer.residuals = fitted.fit, fitted.model, fitted.residuals
+                self.__applied = True
+
+    def cancel(self):
+        """Stops the job; returns False if it has already finished"""
+        self.__cancel.set()
+        return self.__future.cancel() or not self.__future.done()
+
+    def cancelled(self):
+        return self.__future.cancelled() or (self.__future.done() and
+                                             isinstance(self.__future.exception(), CancelledError))
+
+    def running(self):
+        return self.__future.running()
+
+    def done(self):
+        return self.__future.done()
+
+    def result(self, timeout=None):
+        """Waits for the job and returns the fit command's message; raises CancelledError if it was cancelled"""
+        return self.__future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.__future).__await__()
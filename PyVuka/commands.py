@@ -959,13 +959,13 @@ class Command(object):
 
         pti = 1 if not xr else min(xr)
         ptf = self.inst.data.matrix.buffer(1).data.x.length() if not xr else max(xr)
-        self(f'fix all')
         self(f'pl off')
         self(f'pl {firstbuffer} {lastbuffer} {pti} {ptf}')
         self(f'pl on')
-        self(f'fit')
+        fitter = fitfxns.datafit(self.inst)
+        for i in range(firstbuffer, lastbuffer + 1):
+            fitter.modelbuffer(i)
         self(f'pl off')
-        self(f'fre all')
 
         self.inst.data.plot_limits.x_range.set(xr)
         self.inst.data.plot_limits.y_range.set(yr)
@@ -1237,17 +1237,40 @@ class Command(object):
         Example Usage:
         \tfit            (fit data with up to 2000 iterations)
         \tfit 100        (fit data with up to 100 iterations)
+        \tfit -sparse    (fit linked global groups with a sparse trust-region solver)
+        \tfit -ind -multistart 16 -cpu 8    (16 starting points per buffer, run on up to 8 cores)
+        \tfit -ind -batch                  (fit every buffer together in one stacked solver)
 
         Default Input: fit 2000
 
         Default Options: N/A
 
-        Options: N/A"""
+        Options:
+        \t-ind          (fit each buffer independently, ignoring links)
+        \t-group N      (fit buffers in global groups of N)
+        \t-cpu N        (fit groups on up to N cores)
+        \t-silent       (do not print fit statistics)
+        \t-debug        (print fit report for every buffer)
+        \t-sparse       (trust-region least-squares using the block sparsity of the group Jacobian)
+        \t-shm          (with -cpu, send data to worker processes through shared memory)
+        \t-nocache      (always refit, even if an identical fit is in the session's fit cache)
+        \t-warm         (fit groups nearest-first on one core, seeding each from the most similar group already fit)
+        \t-multistart N (fit each group from N starting points and keep the lowest chi-square)
+        \t-varpro       (solve parameters the model is linear in, e.g. amplitudes, by linear least squares)
+        \t-irf          (convolve the model with each buffer's instrument response before computing residuals)
+        \t-f32          (evaluate models in single precision for screening fits; chi-square stays double precision)
+        \t-chitol X     (stop a group early once its chi-square improves by less than X (relative) per iteration)
+        \t-ptol X       (stop a group early once no free parameter changes by more than X (relative) per iteration)
+        \t-budget S     (stop a group early after S seconds, keeping the best parameters reached)
+        \t-batch        (with -ind, fit buffers sharing one function and length together in a single stacked
+        \t               Levenberg-Marquardt iteration, in double precision even with -f32; otherwise fits
+        \t               as -ind)"""
         args = [val.lower() for val in args]
         inparse = inputprocessing.InputParser()
         inparse(args)
         if len(inparse.userinput) == 0:
-            args.append('2000')
+            # iteration count goes first so a trailing flag (-multires) does not take it as its value
+            args.insert(0, '2000')
         ### Pre-flight check for any parameter linking ###
         linked = False
         plon = False
@@ -1274,9 +1297,10 @@ class Command(object):
                 buffer = self.inst.data.matrix.buffer(i)
                 alllinks.append(buffer.fit.link.get())
             self("unl -all")
+            linked = False
         ### If data is not linked or override to independent fitting and restore link and plot limit states###
         if not linked:
-            print(fitfxns.datafit(self.inst).dofit(*args))
+            message = fitfxns.datafit(self.inst).dofit(*args)
             self("pl off")
             if plon:
                 com_list = [firstbuffer, lastbuffer, firstpoint, lastpoint]
@@ -1288,13 +1312,108 @@ class Command(object):
         if "-ind" in args:  ### if -ind flag, restore original links ###
             for i in range(firstbuffer, lastbuffer + 1):
                 buffer = self.inst.data.matrix.buffer(i)
-                buffer.fit.link.set(alllinks[i - 1])
-            return "\nIndependent Fitting Complete!"
-        elif not linked:
-            return "\nIndependent Fitting Complete!"
-        else:  ### if data is linked we run global fitting ###
-            print(fitfxns.datafit(self.inst).dofit(*args))
-            return "\nGlobal Fitting Complete!"
+                buffer.fit.link.set(alllinks[i - firstbuffer])
+        if linked:  ### if data is linked we run global fitting ###
+            message = fitfxns.datafit(self.inst).dofit(*args)
+        if not message.endswith('Fitting Complete!'):
+            # the fit did not run: invalid parameters or linking scheme
+            return message
+        print(message)
+        return "\nGlobal Fitting Complete!" if linked else "\nIndependent Fitting Complete!"
+
+    def do_unc(self, *args):
+        """\nCommand: UNCertainty\n
+        Description: Estimates parameter confidence intervals by refitting resampled data around the best fit
+        Each group is first refit from its current parameters
+        Results are stored in each buffer as fit.parameter_percentiles ([low, median, high] per parameter)
+
+        Example Usage:
+        \tunc                     (95% intervals from 200 residual bootstrap refits per group)
+        \tunc -mc -n 500 -ci 68   (68% intervals from 500 Monte Carlo refits using data.ye as the noise)
+        \tunc -ind -cpu 8         (each buffer independently, on up to 8 cores)
+
+        Default Input: unc -n 200 -ci 95 -boot
+
+        Default Options: N/A
+
+        Options:
+        \t-n N          (number of refits per group)
+        \t-ci N         (confidence interval in percent)
+        \t-boot         (resample the fit residuals with replacement)
+        \t-mc           (add gaussian noise of width data.ye, or the residual spread if there is no y error)
+        \t-ind, -group N, -cpu N, -shm, -sparse, -silent    (as for fit)"""
+        args = [val.lower() for val in args]
+        if self.inst.data.plot_limits.is_active:
+            firstbuffer, lastbuffer = self.inst.data.plot_limits.buffer_range.get()
+        else:
+            firstbuffer, lastbuffer = 1, self.inst.data.matrix.length()
+        alllinks = []
+        if "-ind" in args:
+            for i in range(firstbuffer, lastbuffer + 1):
+                alllinks.append(self.inst.data.matrix.buffer(i).fit.link.get())
+            self("unl -all")
+        try:
+            return fitfxns.datafit(self.inst).douncertainty(*args)
+        finally:
+            for i in range(firstbuffer, lastbuffer + 1) if alllinks else []:
+                self.inst.data.matrix.buffer(i).fit.link.set(alllinks[i - firstbuffer])
+
+    def do_ci(self, *args):
+        """\nCommand: Confidence Intervals\n
+        Description: Profile likelihood confidence intervals for every free parameter of the current fit
+        Bounds are stored in each buffer as meta_dict['profile_ci'] ([low, high] per parameter, None if not free)
+
+        Example Usage:
+        \tci                  (95% intervals)
+        \tci -ci 68 -cpu 8    (68% intervals, parameters and buffers profiled on up to 8 cores)
+        \tci -ind             (each buffer independently)
+
+        Default Input: ci -ci 95
+
+        Default Options: N/A
+
+        Options:
+        \t-ci N         (confidence interval in percent)
+        \t-ind, -group N, -cpu N, -shm, -sparse, -silent    (as for fit)"""
+        args = [val.lower() for val in args]
+        if self.inst.data.plot_limits.is_active:
+            firstbuffer, lastbuffer = self.inst.data.plot_limits.buffer_range.get()
+        else:
+            firstbuffer, lastbuffer = 1, self.inst.data.matrix.length()
+        alllinks = []
+        if "-ind" in args:
+            for i in range(firstbuffer, lastbuffer + 1):
+                alllinks.append(self.inst.data.matrix.buffer(i).fit.link.get())
+            self("unl -all")
+        try:
+            return fitfxns.datafit(self.inst).doprofile(*args)
+        finally:
+            for i in range(firstbuffer, lastbuffer + 1) if alllinks else []:
+                self.inst.data.matrix.buffer(i).fit.link.set(alllinks[i - firstbuffer])
+
+    def do_cmp(self, *args):
+        """\nCommand: CoMPare models\n
+        Description: Fits each candidate function set to every buffer independently and ranks them per buffer
+        The ranking is stored in each buffer as meta_dict['model_comparison'] (rank, aic, bic, redchi, delta and
+        Akaike/Schwarz weight per candidate); the winning function set and its fitted parameters are applied
+
+        Example Usage:
+        \tcmp 40 41 42              (fit functions 40, 41 and 42 to every buffer, keep the lowest AIC)
+        \tcmp 2 2+1 -by bic -cpu 8  (function 2 against functions 2 and 1 combined, by BIC on up to 8 cores)
+
+        Default Input: N/A
+
+        Default Options: -by aic
+
+        Options:
+        \t-by X         (rank candidates by aic, bic or redchi)
+        \t-maxiter N    (fit with up to N iterations, default 2000)
+        \t-nostore      (rank only, leave the buffers' functions and parameters unchanged)
+        \t-cpu N, -shm, -sparse, -varpro, -silent    (as for fit)
+
+        Notes: A candidate that is a buffer's current function set starts from the buffer's parameters, bounds
+        and fix state; other candidates start from the function defaults with every parameter free"""
+        return fitfxns.datafit(self.inst).docompare(*args)
 
     def do_ap(self, *args):
         """\nCommand: Alter Parameters\n
@@ -531,14 +531,17 @@ class Buffer(object):
             self.function_index = self._base_list()
             self.parameter = self._base_list()
             self.parameter_error = self._base_list()
+            self.parameter_percentiles = self._base_list()
             self.parameter_bounds = self._base_bounds()
             self.chisq = self._base_float()
             self.rsq = self._base_float()
             self.link = self._base_list()
             self.free = self._base_list()
             self.use_error_weighting = True
+            self.use_irf_reconvolution = False
             self.fit_failed = False
             self.fit_failed_reason = self._base_str()
+            self.stop_reason = self._base_str()
 
         class _base_str(object):
             def __init__(self):
@@ -1,13 +1,36 @@
 import numpy as np
 from lmfit import minimize, Parameters, report_fit
-from functools import partial
+from lmfit.minimizer import MinimizerResult
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
 import copy
 import itertools
+import re
+import time
+import threading
+import hashlib
+import pickle
+import queue
+from collections import OrderedDict, deque
+import json
+import csv
+import io
+import scipy.fft
+import scipy.optimize
+import scipy.sparse
+import scipy.stats
+try:
+    from . import numericalmethods
+except:
+    import numericalmethods  # required for running directly
 
 #constants
 gas_const_kcal = .0019872036
 
+# compiled model callables, keyed by (function index tuple, function string)
+_compiled_models = {}
+
 class datafit(object):
     """extend with fxn_index  methods. index must be an integer.
 
@@ -20,6 +43,13 @@ class datafit(object):
         where "Generic Function" is the category of the function and "Constant (additive)" is the function name"
 
     Remaining doctstring format should be conserved as it is the description used by the 'fun info' command.
+
+    Functions may optionally declare analytic partial derivatives (dY/dP[n]) so fits can use an analytic Jacobian:
+    string functions extend self.derivatives with one expression per parameter, pyscript functions set
+    self.pyjacobian to a compiled script filling J[n] for each parameter.
+
+    Functions may also extend self.linear with one flag per parameter, marking parameters the function is (jointly)
+    linear in so fit -varpro can solve them by linear least squares.
         """
 
     def __init__(self, data_instance, info_commands=('info', '?')):
@@ -30,7 +60,10 @@ class datafit(object):
         self.paramdefaults = []
         self.funcindex = []
         self.functions = []
+        self.derivatives = []
+        self.linear = []
         self.pyscript = False
+        self.pyjacobian = None
         self.tzerooffset = False
         self.pyscriptonly = False
         self.inst = data_instance
@@ -56,7 +89,10 @@ class datafit(object):
         self.paramdefaults = []
         self.funcindex = []
         self.functions = []
+        self.derivatives = []
+        self.linear = []
         self.pyscript = []
+        self.pyjacobian = None
         return True
 
     def fxn_1(self, *args):
@@ -69,6 +105,8 @@ class datafit(object):
         self.parambounds.extend([[-np.inf, np.inf]])
         self.paramdefaults.extend([0])
         self.functions.extend(["Y=(X*0)+P[0]"])
+        self.derivatives.extend(["(X*0)+1"])
+        self.linear.extend([True])
         return
 
     def fxn_2(self, *args):
@@ -82,6 +120,8 @@ class datafit(object):
         self.parambounds.extend([[-np.inf, np.inf], [0, np.inf]])
         self.paramdefaults.extend([1, 1])
         self.functions.extend(["Y=P[0]*np.exp(-1*X/P[1])"])
+        self.derivatives.extend(["np.exp(-1*X/P[1])", "P[0]*X/(P[1]**2)*np.exp(-1*X/P[1])"])
+        self.linear.extend([True, False])
         return
 
     def fxn_3(self, *args):
@@ -96,6 +136,10 @@ class datafit(object):
         self.parambounds.extend([[-np.inf, np.inf], [0, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([10, 5, 5])
         self.functions.extend(["Y=(P[0]/(np.sqrt(2*np.pi)*P[1]))*np.exp(-(X-P[2])**2/(2*P[1]**2))"])
+        self.linear.extend([True, False, False])
+        self.derivatives.extend(["(1/(np.sqrt(2*np.pi)*P[1]))*np.exp(-(X-P[2])**2/(2*P[1]**2))",
+                                 "(P[0]/(np.sqrt(2*np.pi)*P[1]))*np.exp(-(X-P[2])**2/(2*P[1]**2))*(((X-P[2])**2/P[1]**3)-(1/P[1]))",
+                                 "(P[0]/(np.sqrt(2*np.pi)*P[1]))*np.exp(-(X-P[2])**2/(2*P[1]**2))*((X-P[2])/P[1]**2)"])
         return
 
     def fxn_27(self, *args):
@@ -109,6 +153,8 @@ class datafit(object):
         self.parambounds.extend([[-np.inf, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([1, 0])
         self.functions.extend(["Y=(P[0]*X)+P[1]"])
+        self.derivatives.extend(["X", "(X*0)+1"])
+        self.linear.extend([True, True])
         return
 
     def fxn_30(self, *args):
@@ -121,6 +167,8 @@ class datafit(object):
         self.parambounds.extend([[-np.inf, np.inf]])
         self.paramdefaults.extend([0])
         self.functions.extend(["Y=X*P[0]"])
+        self.derivatives.extend(["X"])
+        self.linear.extend([True])
         return
 
     def fxn_14(self, *args):
@@ -143,6 +191,15 @@ class datafit(object):
                                  [-np.inf, np.inf], [-np.inf, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([5, 1.8, 0, 25000, 1000, 2, 298.15])
         self.functions.extend(["Y=(P[2]+(P[4]*X))+((P[3]+(P[5]*X))*np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))"])
+        # K/(1+K)^2 with K = exp((dG-mX)/RT) is the derivative of the folded fraction with respect to ln(K)
+        self.derivatives.extend(["(P[3]+(P[5]*X))*np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6]))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))**2/(gas_const_kcal*P[6])",
+                                 "-X*(P[3]+(P[5]*X))*np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6]))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))**2/(gas_const_kcal*P[6])",
+                                 "(X*0)+1",
+                                 "np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6]))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))",
+                                 "X",
+                                 "X*np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6]))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))",
+                                 "-(P[3]+(P[5]*X))*np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6]))/(1+np.exp((P[0]-(P[1]*X))/(gas_const_kcal*P[6])))**2*(P[0]-(P[1]*X))/(gas_const_kcal*P[6]**2)"])
+        self.linear.extend([False, False, True, True, True, True, False])
         self.pyscriptonly = False
         return
 
@@ -201,17 +258,17 @@ P[6] * ((((P[7] * P[5]) + P[6]) * (P[9] * P[2] * P[10])) + (P[5] * P[6] * P[4]))
 K4 = ((P[2] * P[10] * P[9]) + (P[5] * P[4])) / (P[5] * P[4])
 K5 = (P[2] * P[10] * P[9]) / ((P[2] * P[10] * P[9]) + (P[5] * P[4]))
 K6 = ((P[2] * P[10] * P[9]) + (P[5] * P[4])) / P[5]
-Rz = None
-for j in range(len(X)):
-    if X[j] <= P[8]:
-        # calc association
-        Wval = numericalmethods.lambertw(K2 * np.exp(K2 - (K3 * P[6] * X[j])))
-        R[j] = P[4] * K1 * (1 - (Wval / K2))
-        Rz = float(R[j])
-    else:
-        # calc dissociation
-        Wval = numericalmethods.lambertw(((-1 * Rz) / K6) * np.exp(-1 * ((Rz / K6) + (K5 * P[6] * (X[j] - P[8])))))
-        R[j] = (-1 * K6) * Wval
+R = np.zeros(len(X), dtype=X.dtype)
+assoc = X <= P[8]
+# calc association
+Wval = numericalmethods.lambertw_array(K2 * np.exp(K2 - (K3 * P[6] * X[assoc])))
+R[assoc] = P[4] * K1 * (1 - (Wval / K2))
+# calc dissociation, starting from the response of the most recent association point (Rz)
+dissoc = ~assoc
+last = np.maximum.accumulate(np.where(assoc, np.arange(len(X)), -1))[dissoc]
+Rz = np.where(last >= 0, R[last], np.nan)
+Wval = numericalmethods.lambertw_array(((-1 * Rz) / K6) * np.exp(-1 * ((Rz / K6) + (K5 * P[6] * (X[dissoc] - P[8])))))
+R[dissoc] = (-1 * K6) * Wval
 """, '<string>', 'exec')
         self.functions.extend(["Y=X+P[0]"])
         self.pyscriptonly = True
@@ -240,16 +297,47 @@ for j in range(len(X)):
 rm, kd, ka, cp, m, c, xo, kds = P
 if cp==0:
     cp=1E-15
-for j in range(len(X)):
-    if X[j] <= xo:
-        # calc association
-        R[j] = (rm / (1 + (kd / (ka * cp)))) * (1-(np.exp((-1 * X[j] * ((ka * cp) + kd)))))
-    else:
-        # calc dissociation
-        R[j] = kds*(((rm/(1+(kd/(ka*cp))))*(1-np.exp(-1*xo*(ka*cp+kd)))-c))*(np.exp(-1*kd*(X[j]-xo))) + m*(X[j]-xo) + c
+R = np.zeros(len(X), dtype=X.dtype)
+assoc = X <= xo
+dissoc = ~assoc
+# calc association
+R[assoc] = (rm / (1 + (kd / (ka * cp)))) * (1-(np.exp((-1 * X[assoc] * ((ka * cp) + kd)))))
+# calc dissociation
+R[dissoc] = kds*(((rm/(1+(kd/(ka*cp))))*(1-np.exp(-1*xo*(ka*cp+kd)))-c))*(np.exp(-1*kd*(X[dissoc]-xo))) + m*(X[dissoc]-xo) + c
+""", '<string>', 'exec')
+            self.pyjacobian = compile("""
+rm, kd, ka, cp, m, c, xo, kds = P
+if cp==0:
+    cp=1E-15
+J = np.zeros((8, len(X)), dtype=X.dtype)
+assoc = X <= xo
+dissoc = ~assoc
+kobs = (ka * cp) + kd
+req = rm / (1 + (kd / (ka * cp)))
+# partial derivatives of the equilibrium response with respect to rm, kd, ka and cp
+dreq = [(ka * cp) / kobs, -1 * rm * ka * cp / kobs**2, rm * cp * kd / kobs**2, rm * ka * kd / kobs**2]
+dkobs = [0, 1, cp, ka]
+# association phase
+xa = X[assoc]
+ea = np.exp(-1 * xa * kobs)
+for n in range(4):
+    J[n, assoc] = dreq[n] * (1 - ea) + req * xa * ea * dkobs[n]
+# dissociation phase
+xd = X[dissoc] - xo
+ed = np.exp(-1 * kd * xd)
+e0 = np.exp(-1 * xo * kobs)
+b = req * (1 - e0) - c
+for n in range(4):
+    J[n, dissoc] = kds * (dreq[n] * (1 - e0) + req * xo * e0 * dkobs[n]) * ed
+J[1, dissoc] -= kds * b * xd * ed
+J[4, dissoc] = xd
+J[5, dissoc] = 1 - kds * ed
+J[6, dissoc] = kds * (req * kobs * e0 + b * kd) * ed - m
+J[7, dissoc] = b * ed
 """, '<string>', 'exec')
 
             self.functions.extend(["Y=(P[0]/(1+(P[1]/(P[2]*P[3]))))*(1-(np.exp((-1*X*((P[2]*P[3])+P[1])))))+(P[7]*(((P[0]/(1+(P[1]/(P[2]*P[3]))))*(1-np.exp(-1*P[6]*(P[2]*P[3]+P[1])))-P[5]))*(np.exp(-1*P[1]*(X-P[6])))+P[4]*(X-P[6])+P[5])"])
+            self.linear.extend([True, False, False, False, True, True, False, False])
             return
 
     def fxn_41(self, *args):
@@ -266,6 +354,11 @@ for j in range(len(X)):
         self.parambounds.extend([[0, np.inf], [-1000, 1000], [-np.inf, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([5, 1, 0, 100])
         self.functions.extend(["Y=P[2]+((P[3]-P[2])/(1+((P[0]/X)**P[1])))"])
+        self.derivatives.extend(["-(P[3]-P[2])*((P[0]/X)**P[1])*(P[1]/P[0])/(1+((P[0]/X)**P[1]))**2",
+                                 "-(P[3]-P[2])*((P[0]/X)**P[1])*np.log(P[0]/X)/(1+((P[0]/X)**P[1]))**2",
+                                 "1-(1/(1+((P[0]/X)**P[1])))",
+                                 "1/(1+((P[0]/X)**P[1]))"])
+        self.linear.extend([False, False, True, True])
         # Y=minY+((maxY-minY)/(1+((EC50/X[0])^HillCoef)))
         return
 
@@ -283,6 +376,11 @@ for j in range(len(X)):
         self.parambounds.extend([[0, np.inf], [0, np.inf], [-np.inf, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([0.5, 100, 1000, 0])
         self.functions.extend(["Y=(P[3]+P[2])*((P[1]+X+P[0])-np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5)) /(2*P[1])"])
+        self.derivatives.extend(["(P[3]+P[2])*(1-((P[1]+X+P[0])/np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5)))/(2*P[1])",
+                                 "(P[3]+P[2])*(((1-((P[1]+X+P[0]-(2*X))/np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5)))/(2*P[1]))-(((P[1]+X+P[0])-np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5))/(2*P[1]**2)))",
+                                 "((P[1]+X+P[0])-np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5)) /(2*P[1])",
+                                 "((P[1]+X+P[0])-np.power(np.power(P[1]+X+P[0], 2)-(4*P[1]*X), 0.5)) /(2*P[1])"])
+        self.linear.extend([False, False, True, False])
         # Y=S0+Amp*((c+X+Keq)-((c+X+Keq)^2 -(4*c*X))^0.5 )/2*c
         return
 
@@ -301,6 +399,8 @@ for j in range(len(X)):
         self.parambounds.extend([[0, np.inf], [0, np.inf], [-np.inf, np.inf]])
         self.paramdefaults.extend([0.5, 1000, 0])
         self.functions.extend(["Y=((P[1]*X)/(P[0]+X))+P[2]"])
+        self.derivatives.extend(["-(P[1]*X)/(P[0]+X)**2", "X/(P[0]+X)", "(X*0)+1"])
+        self.linear.extend([False, True, True])
         # Y=(Bmax*X/(Keq + X))+S0; BP=Bmax/Keq
         return
 
@@ -352,38 +452,32 @@ for j in range(len(X)):
         firstindex = 1
         lastindex = 1
         fxnindicies = self.funcindex
-        fxns = self.functions
+        paramcounts = []
         for f in self.funcindex:
             fn = getattr(self, 'fxn_' + str(f))
+            numparams = len(self.paramid)
             fn()
+            paramcounts.append(len(self.paramid) - numparams)
         if self.inst.data.plot_limits.is_active:
             firstindex = min(self.inst.data.plot_limits.buffer_range.get())
             lastindex = max(self.inst.data.plot_limits.buffer_range.get())
         else:
             firstindex = 1
             lastindex = self.inst.data.matrix.length() + 1
-        maxindex = 0
-        for k in range(len(fxns)):
-            fxnsplit = fxns[k].split("P[")
-            for f in range(0, len(fxnsplit) - 1, 1):
-                fxnsplit[f] += "P["
-                tempstr = fxnsplit[f + 1].split(']')
-                fxnsplit[f + 1] = str(int(tempstr[0]) + maxindex) + ']' + tempstr[1]
-            maxindex = int(tempstr[0]) + maxindex + 1
-            fxns[k] = ''.join(fxnsplit)
-        tempfxn = ''
-        for j in range(len(fxns)):
-            yval, xval = fxns[j].split('=')
-            tempfxn += xval + '+'
+        tempfxn = '+'.join(offset_fxn_params(self.functions, paramcounts))
+        # compile once here so fitting and modeling reuse the same callable
+        compile_model(fxnindicies)
         try:
             for i in range(firstindex, lastindex):
                 self.inst.data.matrix.buffer(i).fit.function_index.set(fxnindicies)
-                self.inst.data.matrix.buffer(i).fit.function.set(tempfxn[:-1])
+                self.inst.data.matrix.buffer(i).fit.function.set(tempfxn)
         except:
             return False
         return True
 
-    def dofit(self, *args):
+    def build_fit(self, *args):
+        """Parses fit flags and builds the fit groups of every buffer in range.  Returns the param_dict passed to
+        multi_fit, or an error message string"""
         fitparams = datafit(self.inst)
         args = [int(val) if val.isdigit() else val.lower() for val in args]
         method = "Leastsq"
@@ -391,9 +485,23 @@ for j in range(len(X)):
         group = abs(args[args.index('-group') + 1]) if '-group' in args and args.index('-group') < len(args) and is_integer(args[args.index('-group') + 1]) else 1 if '-ind' in args else self.inst.data.matrix.length()
         cpu = abs(args[args.index('-cpu') + 1]) if '-cpu' in args and args.index('-cpu') < len(args) and is_integer(args[args.index('-cpu') + 1]) else 1
         ind_fit = True if '-ind' in args else False
+        sparse = True if '-sparse' in args else False
+        shm = True if '-shm' in args else False
+        warm = True if '-warm' in args else False
+        varpro = True if '-varpro' in args else False
+        irf = True if '-irf' in args else False
+        f32 = True if '-f32' in args else False
+        batch = True if '-batch' in args else False
+        # decimation stride of the coarse pass, 0 to pick one from the trace length
+        multires = (abs(args[args.index('-multires') + 1]) if args.index('-multires') < len(args) - 1 and is_integer(args[args.index('-multires') + 1]) else 0) if '-multires' in args else None
+        multistart = abs(args[args.index('-multistart') + 1]) if '-multistart' in args and args.index('-multistart') < len(args) - 1 and is_integer(args[args.index('-multistart') + 1]) else 0
+        method = "least_squares" if sparse else method
         group = 1 if ind_fit else group
         silent = True if "-silent" in args else False
         iter_cb = debug_fitting if debug else None
+        # early stopping: relative chi-square plateau, relative parameter change, seconds per group
+        converge = tuple(flag_float(args, flag) for flag in ('-chitol', '-ptol', '-budget'))
+        converge = None if converge == (None, None, None) else converge
         max_iter = int(args[0]) if isinstance(args[0], int) else 2000
         bmax = self.inst.data.matrix.length() #if not self.inst.data.plot_limits.is_active else max(self.inst.data.plot_limits.buffer_range.get())
         bmin = 1 if not self.inst.data.plot_limits.is_active else min(self.inst.data.plot_limits.buffer_range.get())
@@ -409,7 +517,11 @@ for j in range(len(X)):
         FXN_vec = []
         WEIGHTS_vec = []
         FXN_NUM_vec = []
+        MODEL_vec = []
+        PLAN_vec = []
         PARAM_ID_vec = []
+        ALIAS_vec = []
+        LINES_vec = []
         Y_matrix = []
         for i in range(bmin, bmax+1, group):
             parameters = Parameters()
@@ -422,6 +534,10 @@ for j in range(len(X)):
             fxn_group = []
             weights_group = []
             fxn_num_group = []
+            model_group = []
+            param_id_group = []
+            lines_group = []
+            param_specs = []
             for j in range(group):
                 k=i+j
                 fitparams.clear()
@@ -434,17 +550,11 @@ for j in range(len(X)):
                     return "Invalid Parameters!  Try Function: ap ."
 
                 for m in range(len(p_init)):
-                    try:
-                        parameters.add(name=fitparams.paramid[m] + "_{}_{}".format(m+1, k),
-                                       value=float(self.inst.data.matrix.buffer(k).fit.parameter.get()[m]),
-                                       min=float(min(fitparams.parambounds[m])), max=float(max(fitparams.parambounds[m])),
-                                       expr=self.inst.data.matrix.buffer(k).fit.link.get()[m],
-                                       vary=self.inst.data.matrix.buffer(k).fit.free.get()[m])
-                    except (NameError, ValueError) as e:
-                        if isinstance(e, NameError):
-                            return "Parameter Linking Scheme is Invalid!"
-                        elif isinstance(e, ValueError):
-                            return "Parameters Return Invalid Results!!"
+                    param_specs.append({'name': fitparams.paramid[m] + "_{}_{}".format(m+1, k),
+                                        'value': float(self.inst.data.matrix.buffer(k).fit.parameter.get()[m]),
+                                        'min': float(min(fitparams.parambounds[m])), 'max': float(max(fitparams.parambounds[m])),
+                                        'expr': self.inst.data.matrix.buffer(k).fit.link.get()[m],
+                                        'vary': self.inst.data.matrix.buffer(k).fit.free.get()[m]})
 
                 x_group.append(self.inst.data.matrix.buffer(k).data.x.get())
                 y_group.append(self.inst.data.matrix.buffer(k).data.y.get())
@@ -454,9 +564,34 @@ for j in range(len(X)):
                 ir_z_group.append(self.inst.data.matrix.buffer(k).instrument_response.z.get())
                 weights_group.append(self.inst.data.matrix.buffer(k).data.ye.get())
                 fxn_group.append(self.inst.data.matrix.buffer(k).fit.function.get())
-                temp_df = datafit(self.inst)
-                temp_df.update(self.inst.data.matrix.buffer(k).fit.function_index.get())
                 fxn_num_group.append(self.inst.data.matrix.buffer(k).fit.function_index.get())
+                model_group.append(compile_model(fxn_num_group[-1], fxn_group[-1]))
+                if irf and len(ir_y_group[-1]) > 1:
+                    try:
+                        model_group[-1] = ReconvolvedModel(model_group[-1], x_group[-1], ir_x_group[-1], ir_y_group[-1])
+                    except ValueError as e:
+                        return str(e)
+                param_id_group.append([fitparams.paramid[m] + "_{}_{}".format(m+1, k) for m in range(len(p_init))])
+                lines_group.append(self.inst.data.matrix.buffer(k).plot.axis.x.lines.get())
+
+            # identity links ("same as buffer k, parameter m") are resolved to an index map and never reach asteval
+            aliases = resolve_links(param_specs)
+            if aliases is None:
+                return "Parameter Linking Scheme is Invalid!"
+            for spec in param_specs:
+                if spec['name'] in aliases:
+                    continue
+                if spec['expr'] is not None:
+                    spec['expr'] = re.sub(r'[A-Za-z_][A-Za-z0-9_]*', lambda t: aliases.get(t.group(0), t.group(0)),
+                                          spec['expr'])
+                try:
+                    parameters.add(**spec)
+                except (NameError, ValueError) as e:
+                    if isinstance(e, NameError):
+                        return "Parameter Linking Scheme is Invalid!"
+                    elif isinstance(e, ValueError):
+                        return "Parameters Return Invalid Results!!"
+            ALIAS_vec.append(aliases)
             X_vec.append(x_group)
             Y_vec.append(y_group)
             Z_vec.append(z_group)
@@ -467,22 +602,96 @@ for j in range(len(X)):
             WEIGHTS_vec.append(weights_group)
             FXN_vec.append(fxn_group)
             FXN_NUM_vec.append(fxn_num_group)
+            MODEL_vec.append(model_group)
+            PARAM_ID_vec.append(param_id_group)
+            LINES_vec.append(lines_group)
 
-        try:
-            for vec in Y_vec:
-                Y_matrix.append(np.array(vec))
-                assert Y_matrix[-1].shape == (len(Y_matrix[-1]), max([len(y) for y in vec]))
-        except AssertionError:
-            return "All Buffers Must Be the Same Number of Points!  Try Commands: pl or res or tri"
+        # buffers of a group may differ in length; EvalPlan concatenates their residuals
+        for vec in Y_vec:
+            Y_matrix.append([np.asarray(y) for y in vec])
+
+        for n in range(len(P_vec)):
+            PLAN_vec.append(EvalPlan(P_vec[n], PARAM_ID_vec[n], X_vec[n], Y_vec[n], Z_vec[n], IR_X_vec[n], IR_Y_vec[n],
+                                     IR_Z_vec[n], WEIGHTS_vec[n], MODEL_vec[n], ALIAS_vec[n]))
+            if f32:
+                PLAN_vec[-1] = PLAN_vec[-1].as_dtype(np.float32)
 
         param_dict = {'x_vec': X_vec, 'y_vec': Y_vec, 'z_vec': Z_vec, 'p_vec':P_vec, 'y_matrix': Y_matrix,
                       'ir_x_vec': IR_X_vec, 'ir_y_vec': IR_Y_vec, 'ir_z_vec': IR_Z_vec, 'silent': silent,
                       'weights_vec': WEIGHTS_vec, 'fxn_vec': FXN_vec, 'fxn_num_vec': FXN_NUM_vec,
-                      'param_id_vec': PARAM_ID_vec,'method': method, 'debug': debug, 'group': group, 'cpu': cpu,
-                      'ind_fit': ind_fit, 'iter_cb': iter_cb, 'max_iter': max_iter, 'index': i}
+                      'model_vec': MODEL_vec, 'plan_vec': PLAN_vec, 'param_id_vec': PARAM_ID_vec,'method': method, 'debug': debug, 'group': group, 'cpu': cpu,
+                      'ind_fit': ind_fit, 'iter_cb': iter_cb, 'max_iter': max_iter, 'sparse': sparse, 'shm': shm, 'index': i,
+                      'warm': warm, 'multistart': multistart, 'nocache': '-nocache' in args, 'bmin': bmin, 'bmax': bmax,
+                      'varpro': varpro, 'multires': multires, 'lines_vec': LINES_vec, 'irf': irf,
+                      'f32': f32, 'converge': converge, 'batch': batch}
+        return param_dict
 
-        result = multi_fit(param_dict)
+    def dofit(self, *args):
+        param_dict = self.build_fit(*args)
+        if isinstance(param_dict, str):
+            return param_dict
+        PLAN_vec, P_vec = param_dict['plan_vec'], param_dict['p_vec']
+        group, silent, debug = param_dict['group'], param_dict['silent'], param_dict['debug']
+        warm, multistart = param_dict['warm'], param_dict['multistart']
+        bmin, bmax = param_dict['bmin'], param_dict['bmax']
+
+        # set by toPyVuka fit jobs: called as groups finish and may raise FitCancelled to stop the fit
+        progress = getattr(self.inst, 'fit_progress', None)
+        telemetry = getattr(self.inst, 'fit_telemetry', None)
+        cache = getattr(self.inst, 'fit_cache', None) if not param_dict['nocache'] and not warm and multistart < 2 else None
+        fresh = [*range(len(PLAN_vec))]
+        batch = batch_fit(param_dict, progress=progress) if param_dict['batch'] else None
+        if isinstance(batch, str):
+            print(f'Batch fit not possible ({batch}), fitting buffers one by one')
+            batch = None
+        if batch is not None:
+            result = batch
+            if progress is not None:
+                progress(param_dict, fresh, result)
+            if not silent:
+                print(f"Batch fit: {sum(r.stop_reason == 'converged' for r in result)} of {len(result)} buffer(s) "
+                      f"converged in {max(r.telemetry['njev'] for r in result)} iteration(s), "
+                      f"{sum(r.fit_time for r in result):.3f}s")
+        elif multistart > 1:
+            result, report = multistart_fit(param_dict, multistart, getattr(self.inst, 'fit_pool', None), progress)
+            if progress is not None:
+                progress(param_dict, fresh, result)
+            if not silent:
+                print(report)
+        elif warm:
+            if param_dict['cpu'] > 1:
+                print('Warm start fits groups one after another, -cpu ignored')
+            result = warm_fit(param_dict, progress)
+            if not silent:
+                print(warm_report(result))
+        elif cache is None:
+            result = multi_fit(param_dict, getattr(self.inst, 'fit_pool', None), progress)
+        else:
+            # identical groups (same data, model, bounds, links and starting values) reuse the cached result
+            keys = [cache.key(PLAN_vec[n], P_vec[n], param_dict) for n in range(len(PLAN_vec))]
+            result = [cache.get(key) for key in keys]
+            miss = [n for n in range(len(result)) if result[n] is None]
+            if progress is not None and len(miss) < len(result):
+                hits = [n for n in range(len(result)) if result[n] is not None]
+                progress(param_dict, hits, [result[n] for n in hits])
+            fresh = miss
+            if len(miss) > 0:
+                for n, r in zip(miss, multi_fit(chunk_param_dict(param_dict, miss), getattr(self.inst, 'fit_pool', None),
+                                                progress)):
+                    result[n] = r
+                    cache.put(keys[n], r)
+            cache.save()
+            if not silent:
+                print(f'Fit cache: {len(result) - len(miss)} hit(s), {len(miss)} miss(es)')
+        if telemetry is not None:
+            # cache hits were not fit again and are not recorded
+            telemetry.add([result[n].telemetry for n in fresh if getattr(result[n], 'telemetry', None) is not None],
+                          ' '.join(['fit', *[str(val) for val in args]]))
         result = self.split_result_by_group(result, group)
+        for n, models in enumerate(param_dict['model_vec']):
+            for j, model in enumerate(models):
+                self.inst.data.matrix.buffer(bmin + n * group + j).fit.use_irf_reconvolution = \
+                    isinstance(model, ReconvolvedModel)
 
         print('Saving parameters to matrix...')
         self.saveparams(result, group, silent)
@@ -516,9 +725,305 @@ for j in range(len(X)):
                 print('Result Bayesian:\t', result[i-bmin].bic)
                 # message
                 print('Fit Details:\t', result[i-bmin].message)
+                print('Stop Reason:\t', getattr(result[i-bmin], 'stop_reason', None))
+                # wall time of the group this buffer was fit in
+                print('Fit Time (s):\t', getattr(result[i-bmin], 'fit_time', None))
+                multires = getattr(result[i-bmin], 'multires', None)
+                if multires is not None:
+                    print(f"Multires:\tcoarse {multires['coarse_time']:.3f}s on {multires['npts'][0]} of "
+                          f"{multires['npts'][1]} pts, refine {multires['refine_time']:.3f}s "
+                          f"({multires['refine_nfev']} evals), largest parameter change in refinement "
+                          f"{100 * multires['max_shift']:.3g}%")
                 print('-----------------------------')
         return "\nData Fitting Complete!"
 
+    def douncertainty(self, *args):
+        """Estimates the distribution of every fitted parameter by refitting resampled copies of the data.  Each
+        group is first refit from the current parameters, as for prof; the replicates are resampled around and warm
+        started from that best fit.  -boot resamples residuals, -mc adds gaussian noise of width data.ye (or the
+        residual spread).  Percentiles are stored in fit.parameter_percentiles as
+        [low, median, high] per parameter; fit flags (-ind, -group N, -cpu N, -shm, -sparse) apply as for fit"""
+        args = [str(val).lower() for val in args]
+        nrep, ci = 200, 95
+        fit_args = ['2000']
+        i = 0
+        while i < len(args):
+            if args[i] in ('-n', '-ci') and i < len(args) - 1 and args[i + 1].isdigit():
+                nrep, ci = (int(args[i + 1]), ci) if args[i] == '-n' else (nrep, int(args[i + 1]))
+                i += 2
+                continue
+            fit_args.append(args[i])
+            i += 1
+        method = 'mc' if '-mc' in args else 'boot'
+        param_dict = self.build_fit(*fit_args)
+        if isinstance(param_dict, str):
+            return param_dict
+        if nrep < 2 or not 0 < ci < 100:
+            return "Invalid number of replicates or confidence interval!"
+        pool = getattr(self.inst, 'fit_pool', None)
+        best = multi_fit(param_dict, pool)
+        ngroups = len(param_dict['plan_vec'])
+        for n in range(ngroups):
+            params = param_dict['p_vec'][n] = copy.deepcopy(param_dict['p_vec'][n])
+            for name in params:
+                params[name].value = best[n].params[name].value
+            param_dict['plan_vec'][n].set_reference(param_dict['plan_vec'][n].values(params))
+
+        idx_list = [n for n in range(ngroups) for _ in range(nrep)]
+        replicates = chunk_param_dict(param_dict, idx_list)
+        replicates['replicate_vec'] = [(method, [n, r]) for n in range(ngroups) for r in range(nrep)]
+        replicates['compact'] = True
+        start = time.perf_counter()
+        results = multi_fit(replicates, pool)
+        elapsed = time.perf_counter() - start
+
+        bounds = [(100 - ci) / 2, 50, 100 - (100 - ci) / 2]
+        failed = 0
+        for n in range(ngroups):
+            group_results = [r for r in results[n * nrep:(n + 1) * nrep] if not r.aborted]
+            failed += nrep - len(group_results)
+            samples = [dict(zip(r.names, r.values)) for r in group_results]
+            for j, names in enumerate(param_dict['param_id_vec'][n]):
+                buffer = self.inst.data.matrix.buffer(param_dict['bmin'] + n * param_dict['group'] + j)
+                percentiles = []
+                for name in names:
+                    values = np.array([sample[name] for sample in samples if name in sample], dtype=float)
+                    values = values[np.isfinite(values)]
+                    percentiles.append([float(v) for v in np.percentile(values, bounds)] if len(values) > 0 else
+                                       [np.nan] * 3)
+                buffer.fit.parameter_percentiles.set(percentiles)
+                if not param_dict['silent']:
+                    for name, value, pct in zip(names, buffer.fit.parameter.get(), percentiles):
+                        print(f'{name}: {value}  [{pct[0]}, {pct[2]}] ({ci}%, median {pct[1]})')
+        return (f"\n{nrep} {'bootstrap' if method == 'boot' else 'Monte Carlo'} replicates per group fit in "
+                f"{elapsed:.1f}s ({failed} failed).  {ci}% intervals stored in fit.parameter_percentiles")
+
+    def doprofile(self, *args):
+        """Profile likelihood confidence intervals for every free parameter.  Each group is refit once from the
+        current parameters, then both bounds of every free parameter are walked as separate tasks in the worker
+        pool (-cpu N), warm starting from the best fit.  The interval is where chi-square rises by the F-test
+        threshold for the -ci N level (default 95).  Bounds are written to each buffer's meta_dict['profile_ci']
+        as [low, high] per parameter (None for fixed or expression parameters)"""
+        start = time.perf_counter()
+        args = [str(val).lower() for val in args]
+        ci = 95
+        fit_args = ['2000']
+        i = 0
+        while i < len(args):
+            if args[i] == '-ci' and i < len(args) - 1 and args[i + 1].isdigit():
+                ci = int(args[i + 1])
+                i += 2
+                continue
+            fit_args.append(args[i])
+            i += 1
+        param_dict = self.build_fit(*fit_args)
+        if isinstance(param_dict, str):
+            return param_dict
+        if not 0 < ci < 100:
+            return "Invalid confidence interval!"
+        pool = getattr(self.inst, 'fit_pool', None)
+        setup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        best = multi_fit(param_dict, pool)
+        best_time = time.perf_counter() - start
+
+        ngroups = len(param_dict['plan_vec'])
+        idx_list, p_vec, profile_vec = [], [], []
+        for n in range(ngroups):
+            params = copy.deepcopy(param_dict['p_vec'][n])
+            for name in params:
+                params[name].value = best[n].params[name].value
+            p_vec.append(params)
+            ndof = max(best[n].ndata - best[n].nvarys, 1)
+            fppf = scipy.stats.f.ppf(ci / 100, 1, ndof)
+            target = best[n].chisqr * (1 + fppf / ndof)
+            for name, par in params.items():
+                if not par.vary or par.expr is not None:
+                    continue
+                stderr = best[n].params[name].stderr
+                # first probe near the quadratic estimate of the crossing
+                step = stderr * np.sqrt(fppf) if stderr is not None and np.isfinite(stderr) and stderr > 0 else \
+                    0.1 * abs(par.value) if par.value != 0 else 0.1
+                for direction in (-1, 1):
+                    idx_list.append(n)
+                    profile_vec.append((name, direction, best[n].chisqr, target, step))
+        param_dict['p_vec'] = p_vec
+        tasks = chunk_param_dict(param_dict, idx_list)
+        tasks['profile_vec'] = profile_vec
+        start = time.perf_counter()
+        bounds = multi_fit(tasks, pool)
+        profile_time = time.perf_counter() - start
+
+        intervals = [{} for _ in range(ngroups)]
+        for n, bound in zip(idx_list, bounds):
+            intervals[n].setdefault(bound['name'], [np.nan, np.nan])[(bound['direction'] + 1) // 2] = bound['bound']
+        for n in range(ngroups):
+            aliases = param_dict['plan_vec'][n].aliases
+            for j, names in enumerate(param_dict['param_id_vec'][n]):
+                buffer = self.inst.data.matrix.buffer(param_dict['bmin'] + n * param_dict['group'] + j)
+                buffer.meta_dict['profile_ci'] = [intervals[n].get(aliases.get(name, name)) for name in names]
+                buffer.meta_dict['profile_ci_level'] = ci
+                if not param_dict['silent']:
+                    for name, value, interval in zip(names, buffer.fit.parameter.get(), buffer.meta_dict['profile_ci']):
+                        print(f'{name}: {value}  {interval if interval is not None else "fixed"}')
+
+        limited = [bound for bound in bounds if bound['status'] != 'ok']
+        task_time = sum(bound['time'] for bound in bounds)
+        return (f"\n{ci}% profile likelihood intervals for {len(bounds) // 2} parameter(s) stored in "
+                f"meta_dict['profile_ci'] ({len(limited)} bound(s) at a parameter limit or not found)\n"
+                f"Wall time (s):\tsetup {setup_time:.2f}\tbest fit {best_time:.2f}\tprofiles {profile_time:.2f}"
+                f"\tprofile task time {task_time:.2f}\tfunction evaluations {sum(bound['nfev'] for bound in bounds)}")
+
+    def docompare(self, *args):
+        """Fits every candidate function set to each buffer in range independently and ranks the candidates per
+        buffer by -by aic (default), bic or redchi.  The fits of all candidates run as one task list through
+        multi_fit, so -cpu N spreads them over the worker pool.  A candidate starts from the buffer's current
+        parameters, bounds and fix state when it is the buffer's current function set, otherwise from the function
+        defaults with every parameter free.  The ranking is stored in each buffer's meta_dict['model_comparison'];
+        unless -nostore, the winning function set and its fitted parameters are applied to the buffer"""
+        args = [str(val).lower() for val in args]
+        fxnlist = [int(f) for f in self.getfxnlist()]
+        valued = ('-cpu', '-group', '-multires', '-multistart', '-chitol', '-ptol', '-budget', '-maxiter', '-by')
+        candidates, fit_args, by, max_iter = [], [], 'aic', '2000'
+        i = 0
+        while i < len(args):
+            if args[i] in valued and i < len(args) - 1:
+                if args[i] == '-by':
+                    by = args[i + 1]
+                elif args[i] == '-maxiter':
+                    max_iter = args[i + 1]
+                elif args[i] != '-group':
+                    fit_args.extend(args[i:i + 2])
+                i += 2
+                continue
+            if re.fullmatch(r'\d+(\+\d+)*', args[i]):
+                candidate = tuple(int(f) for f in args[i].split('+'))
+                if any(f not in fxnlist for f in candidate):
+                    return f"Unknown function in candidate {args[i]}!"
+                if candidate not in candidates:
+                    candidates.append(candidate)
+            elif args[i] != '-nostore':
+                fit_args.append(args[i])
+            i += 1
+        if len(candidates) < 2:
+            return "Enter at least two candidate function sets!  Try Function: cmp 40 41 42 ."
+        if by not in ('aic', 'bic', 'redchi'):
+            return "Candidates are ranked by aic, bic or redchi!"
+        if not max_iter.isdigit():
+            return "Invalid iteration count!"
+        names = ['+'.join(str(f) for f in candidate) for candidate in candidates]
+
+        bmin = 1 if not self.inst.data.plot_limits.is_active else min(self.inst.data.plot_limits.buffer_range.get())
+        bmax = self.inst.data.matrix.length()
+        buffers = [self.inst.data.matrix.buffer(i) for i in range(bmin, bmax + 1)]
+        saved = [copy.deepcopy((buffer.fit.function_index.get(), buffer.fit.function.get(), buffer.fit.parameter.get(),
+                                buffer.fit.parameter_bounds.get(), buffer.fit.free.get())) for buffer in buffers]
+        links = [copy.deepcopy(buffer.fit.link.get()) for buffer in buffers]
+        starts = []
+        for candidate in candidates:
+            fitparams, fxn_str = fxn_definition(candidate)
+            nparams = len(fitparams.paramid)
+            defaults = (list(candidate), fxn_str, list(fitparams.paramdefaults), list(fitparams.parambounds),
+                        [True] * nparams)
+            starts.append([copy.deepcopy(state) if tuple(state[0]) == candidate and len(state[2]) == nparams
+                           else copy.deepcopy(defaults) for state in saved])
+
+        def set_state(buffer, state, link):
+            buffer.fit.function_index.set(state[0])
+            buffer.fit.function.set(state[1])
+            buffer.fit.parameter.set(state[2])
+            buffer.fit.parameter_bounds.set(state[3])
+            buffer.fit.free.set(state[4])
+            buffer.fit.link.set(link)
+
+        # candidates are fit independently, so links are dropped while their fits are built
+        param_dicts = []
+        try:
+            for name, states in zip(names, starts):
+                for buffer, state in zip(buffers, states):
+                    set_state(buffer, copy.deepcopy(state), [None] * len(state[2]))
+                param_dict = self.build_fit(max_iter, '-ind', *fit_args)
+                if isinstance(param_dict, str):
+                    return f"Candidate {name}: {param_dict}"
+                param_dicts.append(param_dict)
+        finally:
+            for buffer, state, link in zip(buffers, saved, links):
+                set_state(buffer, state, link)
+
+        nbuf = len(buffers)
+        tasks = merge_param_dicts(param_dicts)
+        tasks['group_index'] = [n for _ in candidates for n in range(nbuf)]
+        tasks['total_groups'] = nbuf
+        start = time.perf_counter()
+        results = multi_fit(tasks, getattr(self.inst, 'fit_pool', None))
+        elapsed = time.perf_counter() - start
+        telemetry = getattr(self.inst, 'fit_telemetry', None)
+        if telemetry is not None:
+            telemetry.add([r.telemetry for r in results if getattr(r, 'telemetry', None) is not None],
+                          ' '.join(['cmp', *args]))
+
+        def score(result):
+            value = None if result is None or result.aborted else getattr(result, by, None)
+            return value if value is not None and np.isfinite(value) else np.inf
+
+        store = '-nostore' not in args
+        silent = param_dicts[0]['silent']
+        winners, wins = [], [0] * len(candidates)
+        for n, buffer in enumerate(buffers):
+            fits = [results[c * nbuf + n] for c in range(len(candidates))]
+            scores = np.array([score(r) for r in fits])
+            order = np.argsort(scores, kind='stable')
+            best = scores[order[0]]
+            weights = np.full(len(fits), np.nan)
+            if by != 'redchi' and np.isfinite(best):
+                # Akaike or Schwarz weights: relative likelihood of each candidate within the set
+                weights = np.exp(-(scores - best) / 2)
+                weights /= weights.sum()
+            buffer.meta_dict['model_comparison'] = [
+                {'functions': list(candidates[c]), 'rank': rank + 1, 'aic': fits[c].aic, 'bic': fits[c].bic,
+                 'redchi': fits[c].redchi, 'chisqr': fits[c].chisqr, 'nvarys': fits[c].nvarys,
+                 'delta': float(scores[c] - best) if np.isfinite(scores[c]) else np.inf, 'weight': float(weights[c]),
+                 'stop_reason': getattr(fits[c], 'stop_reason', None)} for rank, c in enumerate(order)]
+            buffer.meta_dict['model_comparison_by'] = by
+            c = order[0]
+            winners.append(fits[c])
+            if np.isfinite(best):
+                wins[c] += 1
+            if store:
+                # links only survive when the buffer keeps its function set
+                set_state(buffer, copy.deepcopy(starts[c][n]),
+                          links[n] if tuple(saved[n][0]) == candidates[c] else [None] * len(starts[c][n][2]))
+                buffer.fit.use_irf_reconvolution = isinstance(param_dicts[c]['model_vec'][n][0], ReconvolvedModel)
+            if not silent:
+                print(f'Buffer {bmin + n} (ranked by {by.upper()}):')
+                for entry in buffer.meta_dict['model_comparison']:
+                    print(f"  {entry['rank']}. fxn {'+'.join(str(f) for f in entry['functions']):<10}"
+                          f"AIC {entry['aic']:<12.6g}BIC {entry['bic']:<12.6g}Red Chi Sq {entry['redchi']:<12.6g}"
+                          f"d{by.upper()} {entry['delta']:<10.4g}weight {entry['weight']:.3g}")
+
+        if store:
+            # links into a buffer whose function set changed no longer name an existing parameter
+            valid = set()
+            for i in range(1, self.inst.data.matrix.length() + 1):
+                paramid = fxn_definition(self.inst.data.matrix.buffer(i).fit.function_index.get())[0].paramid
+                valid.update(f'{name}_{m + 1}_{i}' for m, name in enumerate(paramid))
+            for buffer in buffers:
+                buffer.fit.link.set([link if link is None or
+                                     all(name in valid for name in re.findall(r'[A-Za-z_]\w*_\d+_\d+', link))
+                                     else None for link in buffer.fit.link.get()])
+            self.saveparams(winners, 1, silent)
+            for i in range(bmin, bmax + 1):
+                try:
+                    self.calcfitstat(i)
+                    self.generatemodel(i, numpts=300)
+                except Exception as e:
+                    print(str(e))
+        return (f"\n{len(candidates)} candidate(s) fit to {nbuf} buffer(s) in {elapsed:.2f}s, ranked by {by.upper()}.  "
+                f"Best: " + ', '.join(f'fxn {name} in {count}' for name, count in zip(names, wins)) +
+                (".  Winning functions and parameters stored" if store else ".  Buffers left unchanged") +
+                ", rankings in meta_dict['model_comparison']")
+
     def split_result_by_group(self, result, group):
         '''Make result vector equivilent size to buffer matrix by splitting results by group'''
         if group == 1:
@@ -556,23 +1061,38 @@ for j in range(len(X)):
         _, X = map(list, zip(*all_x))
         # end add points
 
-        fxn = self.inst.data.matrix.buffer(i).fit.function.get()
+        model = self.buffer_model(i)
         P = self.inst.data.matrix.buffer(i).fit.parameter.get()
         X = np.array(X)
-        R = [0] * len(X)
-
-        if fxn is not False and fxn[:2].upper() == "Y=":
-            fxn = fxn[2:]
-        # execute custom script
-        if self.pyscript:
-            exec(self.pyscript)
-        else:
-            R = eval(str(fxn))
+        R = model(X, P, Y, Z, IRX, IRY, IRZ)
 
         self.inst.data.matrix.buffer(i).model.x.set(X)
         self.inst.data.matrix.buffer(i).model.y.set(R)
         return True
 
+    def buffer_model(self, i):
+        """Compiled model of buffer i as fit evaluates it: convolved with the instrument response when the buffer
+        was last fit with -irf"""
+        buffer = self.inst.data.matrix.buffer(i)
+        model = compile_model(buffer.fit.function_index.get(), buffer.fit.function.get())
+        if buffer.fit.use_irf_reconvolution and len(buffer.instrument_response.y.get()) > 1:
+            model = ReconvolvedModel(model, buffer.data.x.get(), buffer.instrument_response.x.get(),
+                                     buffer.instrument_response.y.get())
+        return model
+
+    def modelbuffer(self, i):
+        """Evaluates the model with the current parameters of buffer i without fitting"""
+        buffer = self.inst.data.matrix.buffer(i)
+        model = self.buffer_model(i)
+        R = model(buffer.data.x.get(), buffer.fit.parameter.get(), buffer.data.y.get(), buffer.data.z.get(),
+                  buffer.instrument_response.x.get(), buffer.instrument_response.y.get(),
+                  buffer.instrument_response.z.get())
+        buffer.residuals.y.set(buffer.data.y.get() - R)
+        buffer.residuals.x.set(buffer.data.x.get())
+        self.calcfitstat(i)
+        self.generatemodel(i, numpts=300)
+        return True
+
     def calcfitstat(self, i):
         rawy = self.inst.data.matrix.buffer(i).data.y.get()
         resid_y = self.inst.data.matrix.buffer(i).residuals.y.get()
@@ -612,7 +1132,8 @@ for j in range(len(X)):
                 y = self.inst.data.matrix.buffer(i).data.y.get()
                 z = self.inst.data.matrix.buffer(i).data.z.get()
                 self.inst.data.matrix.buffer(i).fit.fit_failed = True
-                self.inst.data.matrix.buffer(i).fit.fit_failed_reason.set(str(e))
+                self.inst.data.matrix.buffer(i).fit.fit_failed_reason.set(result[i_idx].message)
+                self.inst.data.matrix.buffer(i).fit.stop_reason.set(result[i_idx].stop_reason)
                 self.inst.data.matrix.buffer(i).fit.parameter.set([-1] * len(parameters))
                 self.inst.data.matrix.buffer(i).fit.parameter_error.set([-1] * len(parameters))
                 self.inst.data.matrix.buffer(i).model.x.set([x[0], x[-1]] if len(x) > 1 else [])
@@ -624,8 +1145,13 @@ for j in range(len(X)):
                     print(f'Buffer {i}: Fit Failed!\n-----------------------------')
                 continue
 
-            # Else, add fit  values to matrix
-            resid= np.array_split(result[i_idx].residual, group)
+            # Else, add fit  values to matrix.  Buffers of a group may differ in length: split the group residual at
+            # its offsets (fit_group puts back the NaN residuals lmfit drops); results without offsets split evenly
+            offsets = getattr(result[i_idx], 'offsets', None)
+            if offsets is not None and len(result[i_idx].residual) == offsets[-1]:
+                resid = [result[i_idx].residual[offsets[n]:offsets[n + 1]] for n in range(len(offsets) - 1)]
+            else:
+                resid = np.array_split(result[i_idx].residual, group)
             # weights used are typically Y error vector
             weights = self.inst.data.matrix.buffer(i).data.ye.get()
             # Residuals are multiplied by the weight vector in the minimization calculation.  Here we reverse that
@@ -635,6 +1161,7 @@ for j in range(len(X)):
                 weights = np.nan_to_num(weights, nan=1.0)
                 unweighted_resid = resid[grp_cnt] if len(weights) <= 1 else resid[grp_cnt] / weights
             self.inst.data.matrix.buffer(i).residuals.y.set(unweighted_resid)
+            self.inst.data.matrix.buffer(i).fit.stop_reason.set(getattr(result[i_idx], 'stop_reason', ''))
             self.inst.data.matrix.buffer(i).residuals.x.set(self.inst.data.matrix.buffer(i).data.x.get())
             for j_idx in range(len(self.paramid)):
                 j = j_idx+1
@@ -654,7 +1181,7 @@ for j in range(len(X)):
         return True
 
 
-def debug_fitting(self, params, nfev, resid, *args, **kwargs):
+def debug_fitting(params, nfev, resid, *args, **kwargs):
     """Function to be called after each iteration of the minimization method
     used by lmfit. Should reveal information about how parameter values are
     changing after every iteration in the fitting routine. See
@@ -670,109 +1197,1883 @@ def is_integer(input):
     return True
 
 
+def flag_float(args, flag):
+    """Value following flag in args as a float, or None if the flag is absent or has no numeric value"""
+    if flag not in args or args.index(flag) >= len(args) - 1:
+        return None
+    try:
+        return abs(float(args[args.index(flag) + 1]))
+    except ValueError:
+        return None
+
+
+def resolve_links(param_specs):
+    """Maps each parameter whose link is a plain parameter name to the unlinked parameter the chain ends at.
+    Returns {name: root name}, or None if a chain is circular or names an unknown parameter.  Any other link
+    expression is left for lmfit to evaluate"""
+    links = {spec['name']: spec['expr'].strip() for spec in param_specs
+             if spec['expr'] is not None and spec['expr'].strip() != ''}
+    names = set([spec['name'] for spec in param_specs])
+    aliases = {}
+    for name, expr in links.items():
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', expr):
+            continue
+        root, seen = expr, {name}
+        while root in links and re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', links[root]):
+            if root in seen:
+                return None
+            seen.add(root)
+            root = links[root]
+        if root not in names:
+            return None
+        aliases[name] = root
+    return aliases
+
+
+def as_float(X):
+    """X as a float array, keeping single precision data (fit -f32) in single precision"""
+    X = np.asarray(X)
+    return X if X.dtype == np.float32 else np.asarray(X, dtype=float)
+
+
+def offset_fxn_params(fxns, paramcounts):
+    """Re-index P[n] in each function string so concatenated functions address consecutive parameters.
+    Returns the right hand side of each function (text after Y=)"""
+    offset = 0
+    rhs = []
+    for fxn, count in zip(fxns, paramcounts):
+        fxn = fxn.split('=', 1)[1] if fxn[:2].upper() == "Y=" else fxn
+        rhs.append(re.sub(r'P\[(\d+)\]', lambda m: 'P[{}]'.format(int(m.group(1)) + offset), fxn))
+        offset += count
+    return rhs
+
+
+def fxn_definition(fxn_index):
+    """datafit holding the parameters of a function combination, and the combined function string applyfxns
+    stores for it"""
+    fitparams = datafit(None)
+    paramcounts = []
+    for f in fxn_index:
+        numparams = len(fitparams.paramid)
+        fitparams.update([f])
+        paramcounts.append(len(fitparams.paramid) - numparams)
+    return fitparams, '+'.join(offset_fxn_params(fitparams.functions, paramcounts))
+
+
+class CompiledModel(object):
+    """Vectorized model callable built once per function combination.
+
+    Called as R = model(X, P, Y, Z, IRX, IRY, IRZ) and returns the model evaluated at every X.
+    Concatenated function strings are compiled to a single lambda; functions defining a pyscript run the
+    pre-compiled script in a private namespace.  When every function declares analytic derivatives,
+    jacobian() returns dY/dP with the same call signature.  Instances pickle by key so worker processes
+    rebuild them from their own cache.
+    """
+    namespace = {'np': np, 'numericalmethods': numericalmethods, 'gas_const_kcal': gas_const_kcal}
+
+    def __init__(self, fxn_index=(), fxn_str=None):
+        self.fxn_index = tuple(fxn_index)
+        self.fxn_str = fxn_str
+        fitparams = datafit(None)
+        paramcounts = []
+        derivatives = []
+        linear = []
+        pyjacobian = None
+        for f in self.fxn_index:
+            numparams = len(fitparams.paramid)
+            numderivatives = len(fitparams.derivatives)
+            numlinear = len(fitparams.linear)
+            pyscript = fitparams.pyscript
+            fitparams.pyjacobian = None
+            fitparams.update([f])
+            paramcounts.append(len(fitparams.paramid) - numparams)
+            if len(fitparams.derivatives) - numderivatives == paramcounts[-1]:
+                derivatives.append(', '.join(fitparams.derivatives[numderivatives:]))
+            linear.extend(fitparams.linear[numlinear:] if len(fitparams.linear) - numlinear == paramcounts[-1] else
+                          [False] * paramcounts[-1])
+            if fitparams.pyscript is not pyscript:
+                pyjacobian = fitparams.pyjacobian
+        self.paramid = fitparams.paramid
+        self.nparams = len(fitparams.paramid)
+        self.pyscript = fitparams.pyscript if fitparams.pyscript else None
+        self.pyjacobian = pyjacobian if self.pyscript is not None else None
+        self.__jac = None
+        if self.pyscript is None and fxn_str is None and 0 < len(derivatives) == len(paramcounts):
+            self.__jac = eval(compile('lambda X, P, Y, Z, IRX, IRY, IRZ: (' +
+                                      ', '.join(offset_fxn_params(derivatives, paramcounts)) + ',)',
+                                      '<jacobian>', 'eval'), dict(self.namespace))
+        self.has_jacobian = self.pyjacobian is not None or self.__jac is not None
+        # parameters the model is jointly linear in; a pyscript replaces the other functions of a combination
+        self.linear = np.array(linear if fxn_str is None and (self.pyscript is None or len(self.fxn_index) == 1)
+                               else [False] * self.nparams, dtype=bool)
+        if fxn_str is None:
+            fxn_str = '+'.join(offset_fxn_params(fitparams.functions, paramcounts))
+        elif fxn_str[:2].upper() == "Y=":
+            fxn_str = fxn_str[2:]
+        self.expression = fxn_str
+        self.__fxn = eval(compile('lambda X, P, Y, Z, IRX, IRY, IRZ: ' + fxn_str, '<model>', 'eval'),
+                          dict(self.namespace)) if fxn_str else None
+
+    def __call__(self, X, P, Y=None, Z=None, IRX=None, IRY=None, IRZ=None):
+        X = as_float(X)
+        if self.pyscript is not None:
+            scope = dict(self.namespace, X=X, Y=Y, Z=Z, IRX=IRX, IRY=IRY, IRZ=IRZ, P=list(P), R=[0] * len(X))
+            exec(self.pyscript, scope)
+            return np.asarray(scope['R'], dtype=X.dtype)
+        R = self.__fxn(X, P, Y, Z, IRX, IRY, IRZ)
+        return R if getattr(R, 'shape', None) == X.shape else np.full(X.shape, R, dtype=X.dtype)
+
+    def jacobian(self, X, P, Y=None, Z=None, IRX=None, IRY=None, IRZ=None):
+        """Returns dY/dP as an array of shape (nparams, len(X)), or None if no analytic derivatives are declared"""
+        X = as_float(X)
+        if self.pyjacobian is not None:
+            scope = dict(self.namespace, X=X, Y=Y, Z=Z, IRX=IRX, IRY=IRY, IRZ=IRZ, P=list(P))
+            exec(self.pyjacobian, scope)
+            return np.asarray(scope['J'], dtype=X.dtype)
+        if self.__jac is None:
+            return None
+        J = np.empty((self.nparams, len(X)), dtype=X.dtype)
+        for n, dydp in enumerate(self.__jac(X, P, Y, Z, IRX, IRY, IRZ)):
+            J[n] = dydp
+        return J
+
+    def stacked(self, X, P, Y=None):
+        """Evaluates the model for a stack of equal-length buffers at once: X and Y of shape (nbuf, npts), P of
+        shape (nbuf, nparams).  Returns (nbuf, npts), or None when the expression does not broadcast over the stack
+        (pyscripts, conditionals on P, Z or instrument response data)"""
+        if self.pyscript is not None or self.__fxn is None:
+            return None
+        try:
+            return np.array(np.broadcast_to(self.__fxn(X, P.T[:, :, None], Y, None, None, None, None), X.shape),
+                            dtype=float)
+        except Exception:
+            return None
+
+    def stacked_jacobian(self, X, P, Y=None):
+        """dY/dP for a stack of buffers as (nbuf, nparams, npts), or None as for stacked()"""
+        if self.__jac is None:
+            return None
+        J = np.empty((X.shape[0], self.nparams, X.shape[1]))
+        try:
+            for n, dydp in enumerate(self.__jac(X, P.T[:, :, None], Y, None, None, None, None)):
+                J[:, n] = dydp
+        except Exception:
+            return None
+        return J
+
+    def __reduce__(self):
+        return compile_model, (self.fxn_index, self.fxn_str)
+
+
+class ReconvolvedModel(object):
+    """Wraps a model so it is convolved with a buffer's instrument response (IRF) before residuals are formed, as
+    in fluorescence lifetime or stopped-flow dead-time fitting.
+
+    The IRF is interpolated onto the buffer's evenly spaced X values (or taken point for point when it has no X),
+    normalized to unit area and its FFT cached, so each evaluation is one padded real FFT pair.  Called with any
+    other X (decimated or plotting points) the model is convolved on the buffer's grid and interpolated.
+    """
+    def __init__(self, model, x, ir_x, ir_y):
+        self.model = model
+        self.grid = np.asarray(x, dtype=float)
+        n = len(self.grid)
+        step = np.diff(self.grid)
+        if n < 2 or not np.allclose(step, step[0], rtol=1E-6, atol=0):
+            raise ValueError("Reconvolution Requires Evenly Spaced X Values!")
+        ir_y = np.asarray(ir_y, dtype=float)
+        if len(ir_x) == len(ir_y):
+            kernel = np.interp(self.grid, np.asarray(ir_x, dtype=float), ir_y, left=0, right=0)
+        else:
+            kernel = np.concatenate([ir_y, np.zeros(max(n - len(ir_y), 0))])[:n]
+        kernel = np.nan_to_num(kernel)
+        if np.sum(kernel) == 0:
+            raise ValueError("Instrument Response Is Empty Over the Data Range!")
+        kernel = np.trim_zeros(kernel / np.sum(kernel), 'b')
+        self.n = n
+        self.nfft = scipy.fft.next_fast_len(n + len(kernel) - 1, real=True)
+        self.kernel_fft = scipy.fft.rfft(kernel, self.nfft)
+        self.__pad = np.zeros(self.nfft)
+        self.has_jacobian = model.has_jacobian
+        self.linear = model.linear
+        self.fxn_index = model.fxn_index
+        self.expression = model.expression
+
+    def convolve(self, R):
+        """Convolves R (n,) or rows of R (k, n) with the IRF"""
+        if R.ndim == 1:
+            pad = self.__pad
+            pad[:self.n] = R
+        else:
+            pad = np.zeros((R.shape[0], self.nfft))
+            pad[:, :self.n] = R
+        return scipy.fft.irfft(scipy.fft.rfft(pad) * self.kernel_fft, self.nfft)[..., :self.n]
+
+    def __on_grid(self, X):
+        return len(X) == self.n and np.isclose(X[0], self.grid[0]) and np.isclose(X[-1], self.grid[-1])
+
+    def __call__(self, X, P, Y=None, Z=None, IRX=None, IRY=None, IRZ=None):
+        X = as_float(X)
+        if self.__on_grid(X):
+            return self.convolve(self.model(X, P, Y, Z, IRX, IRY, IRZ))
+        R = self.convolve(self.model(self.grid, P, Y, Z, IRX, IRY, IRZ))
+        return np.interp(X, self.grid, R)
+
+    def jacobian(self, X, P, Y=None, Z=None, IRX=None, IRY=None, IRZ=None):
+        """Convolution is linear, so the Jacobian is the convolved Jacobian of the wrapped model"""
+        X = as_float(X)
+        if self.__on_grid(X):
+            return self.convolve(np.asarray(self.model.jacobian(X, P, Y, Z, IRX, IRY, IRZ), dtype=float))
+        J = self.convolve(np.asarray(self.model.jacobian(self.grid, P, Y, Z, IRX, IRY, IRZ), dtype=float))
+        return np.array([np.interp(X, self.grid, row) for row in J])
+
+
+def compile_model(fxn_index, fxn_str=None):
+    """Returns the cached CompiledModel for a function index combination, compiling it on first request.
+    fxn_str is only used to build a model when no function indicies are available"""
+    fxn_index = tuple(int(f) for f in fxn_index)
+    key = (fxn_index, None if len(fxn_index) > 0 else fxn_str)
+    if key not in _compiled_models:
+        _compiled_models[key] = CompiledModel(*key)
+    return _compiled_models[key]
+
+
+class EvalPlan(object):
+    """One-time evaluation plan for a fit group, built by datafit.dofit.
+
+    Holds integer index arrays mapping the lmfit Parameters vector onto each buffer's P, the compiled model of
+    each buffer and a preallocated residual vector, so evaluating the objective is array indexing plus model
+    evaluation.  Buffers may differ in length: their residuals are concatenated and buffer i owns
+    resid[offsets[i]:offsets[i + 1]].  aliases maps identity-linked parameter names, which are not in parameters, onto the parameter
+    they share.  While fit_group runs, trace is the group's FitTrace, shared by every copy of the plan.
+    """
+    trace = None
+
+    def __init__(self, parameters, param_names, x_group, y_group, z_group, ir_x_group, ir_y_group, ir_z_group,
+                 weights_group, model_group, aliases=None):
+        self.names = list(parameters.keys())
+        self.aliases = aliases if aliases is not None else {}
+        name_index = {name: n for n, name in enumerate(self.names)}
+        name_index.update({name: name_index[root] for name, root in self.aliases.items()})
+        self.p_index = [np.array([name_index[name] for name in names], dtype=int) for names in param_names]
+        self.models = model_group
+        self.x = [np.asarray(x, dtype=float) for x in x_group]
+        self.y = [np.asarray(y, dtype=float) for y in y_group]
+        self.z = z_group
+        self.ir_x = ir_x_group
+        self.ir_y = ir_y_group
+        self.ir_z = ir_z_group
+        self.weights = [np.asarray(w, dtype=float) if len(w) > 1 else None for w in weights_group]
+        self.allocate(float)
+        self.reset_best()
+        self.__init_jacobian(parameters, name_index)
+
+    def for_parameters(self, parameters):
+        """Copy of the plan for parameters whose free set differs from the one the plan was built with, e.g. with
+        a parameter fixed for profiling; only the Jacobian mapping is rebuilt"""
+        plan = copy.copy(self)
+        name_index = {name: n for n, name in enumerate(self.names)}
+        name_index.update({name: name_index[root] for name, root in self.aliases.items()})
+        plan.__init_jacobian(parameters, name_index)
+        return plan
+
+    def __init_jacobian(self, parameters, name_index):
+        """Maps every parameter to the Jacobian row of the free parameter it resolves to.  Links that are plain
+        parameter names are followed; any other link expression disables the analytic Jacobian"""
+        self.has_jacobian = all([model.has_jacobian for model in self.models])
+        root = list(range(len(self.names)))
+        for n, name in enumerate(self.names):
+            expr = parameters[name].expr
+            if expr is not None and expr.strip() in name_index:
+                root[n] = name_index[expr.strip()]
+            elif expr is not None:
+                self.has_jacobian = False
+        for n in range(len(root)):
+            for _ in range(len(root)):
+                if root[root[n]] == root[n]:
+                    break
+                root[n] = root[root[n]]
+        free = [n for n, name in enumerate(self.names) if parameters[name].vary and parameters[name].expr is None]
+        rows = np.full(len(self.names), -1, dtype=int)
+        rows[free] = np.arange(len(free))
+        self.jac_rows = rows[root]
+        self.nfree = len(free)
+        self.free_idx = np.array(free, dtype=int)
+        self.root = np.array(root, dtype=int)
+        self.start = self.values(parameters)
+        # free parameters each parameter depends on, following arbitrary link expressions by the names they use
+        refs = [[name_index[t] for t in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', parameters[name].expr or '')
+                 if t in name_index] for name in self.names]
+        self.depends = [None] * len(self.names)
+
+        def depends_on(n, visiting=()):
+            if self.depends[n] is None:
+                if rows[n] >= 0:
+                    self.depends[n] = {int(rows[n])}
+                elif n in visiting:
+                    return set()
+                else:
+                    self.depends[n] = set().union(*[depends_on(m, visiting + (n,)) for m in refs[n]])
+            return self.depends[n]
+
+        for n in range(len(self.names)):
+            depends_on(n)
+
+    def allocate(self, dtype):
+        """Builds the offset table from the lengths of y and a zeroed residual vector of dtype"""
+        self.offsets = np.concatenate(([0], np.cumsum([len(y) for y in self.y]))).astype(int)
+        self.resid = np.zeros(self.offsets[-1], dtype=dtype)
+
+    def segment(self, vec, i):
+        """Part of a residual-length vector belonging to buffer i"""
+        return vec[self.offsets[i]:self.offsets[i + 1]]
+
+    def as_dtype(self, dtype):
+        """Copy of the plan holding x, y, weights and the residual vector in dtype, e.g. float32 for fit -f32.
+        Models are evaluated in that precision; the residual handed to the optimizer is always float64"""
+        plan = copy.copy(self)
+        plan.x = [x.astype(dtype) for x in self.x]
+        plan.y = [y.astype(dtype) for y in self.y]
+        plan.weights = [w.astype(dtype) if w is not None else None for w in self.weights]
+        plan.allocate(dtype)
+        return plan
+
+    def fd_kws(self):
+        """leastsq keywords scaling finite difference steps to the plan's precision"""
+        return {'epsfcn': float(np.finfo(self.resid.dtype).eps)} if self.resid.dtype != float else {}
+
+    def without_data(self):
+        """Shallow copy with x, y, weights and the residual buffer removed, for shipping to a worker that attaches
+        them from shared memory"""
+        plan = copy.copy(self)
+        plan.x = plan.y = plan.weights = plan.resid = None
+        return plan
+
+    def attach(self, data, layout):
+        """Points x, y and weights at views of a SharedFitData block; layout holds (offset, length) or None per
+        buffer for x, y and weights"""
+        def view(loc):
+            return None if loc is None else data[loc[0]:loc[0] + loc[1]]
+        self.x = [view(loc[0]) for loc in layout]
+        self.y = [view(loc[1]) for loc in layout]
+        self.weights = [view(loc[2]) for loc in layout]
+        self.allocate(data.dtype)
+
+    def restore_aliases(self, params):
+        """Adds the identity-linked parameters back to fitted params, sharing value and error with their root"""
+        for name, root in self.aliases.items():
+            params.add(name, value=params[root].value, vary=False)
+            params[name].stderr = params[root].stderr
+            params[name].correl = params[root].correl
+        return params
+
+    def sparsity(self):
+        """Returns the Jacobian sparsity pattern (nresid, nfree): each buffer's residuals depend only on the free
+        parameters its own P resolves to through links"""
+        rows = [np.zeros(0, dtype=int)]
+        cols = [np.zeros(0, dtype=int)]
+        for i, p_index in enumerate(self.p_index):
+            free = sorted(set().union(*[self.depends[n] for n in p_index]))
+            rows.append(np.repeat(np.arange(self.offsets[i], self.offsets[i + 1]), len(free)))
+            cols.append(np.tile(np.array(free, dtype=int), self.offsets[i + 1] - self.offsets[i]))
+        rows = np.concatenate(rows)
+        return scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, np.concatenate(cols))),
+                                       shape=(self.resid.size, self.nfree))
+
+    def decimated(self, stride, lines):
+        """Copy of the plan keeping every stride-th point plus stride points either side of each phase boundary
+        (lines holds each buffer's x positions of boundaries), or None if that would not drop any points"""
+        if stride <= 1:
+            return None
+        keep = []
+        for x, buffer_lines in zip(self.x, lines):
+            npts = len(x)
+            kept = set(range(0, npts, stride)) | {npts - 1}
+            for line in buffer_lines:
+                b = int(np.argmin(np.abs(x - float(line))))
+                kept.update(range(max(b - stride, 0), min(b + stride + 1, npts)))
+            keep.append(np.array(sorted(kept)))
+        if sum([len(k) for k in keep]) >= self.resid.size:
+            return None
+        plan = copy.copy(self)
+        plan.x = [x[k] for x, k in zip(self.x, keep)]
+        plan.y = [y[k] for y, k in zip(self.y, keep)]
+        plan.z = [np.asarray(z)[k] if len(z) == len(x) else z for z, x, k in zip(self.z, self.x, keep)]
+        plan.weights = [w[k] if w is not None else None for w, k in zip(self.weights, keep)]
+        plan.allocate(self.resid.dtype)
+        plan.reset_best()
+        return plan
+
+    def project(self, parameters):
+        """Copy of the plan for variable projection, or None if no parameter qualifies.  A free, unlinked parameter
+        is projected when every model using it is linear in it and no link expression refers to it; the copy's
+        residual solves the projected parameters by (bounded) linear least squares at each call, so a fit varies
+        only the remaining parameters.  Projected parameters must be held fixed in the Parameters passed to it"""
+        used = set(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', ' '.join(par.expr for par in parameters.values()
+                                                                   if par.expr is not None)))
+        linear = np.array([parameters[name].vary and parameters[name].expr is None and name not in used
+                           for name in self.names])
+        for model, index in zip(self.models, self.p_index):
+            linear[index[~model.linear]] = False
+        if not linear.any():
+            return None
+        plan = copy.copy(self)
+        plan.linear_idx = np.flatnonzero(linear)
+        plan.linear_bounds = (np.array([parameters[self.names[n]].min for n in plan.linear_idx]),
+                              np.array([parameters[self.names[n]].max for n in plan.linear_idx]))
+        # buffers sharing a projected parameter are solved together, the rest one buffer at a time
+        block = list(range(len(self.p_index)))
+
+        def root(i):
+            while block[i] != i:
+                i = block[i]
+            return i
+        first = {}
+        for i, index in enumerate(self.p_index):
+            for n in index[linear[index]]:
+                j, k = root(first.setdefault(n, i)), root(i)
+                block[max(j, k)] = min(j, k)
+        blocks = {}
+        for i in range(len(block)):
+            blocks.setdefault(root(i), []).append(i)
+        plan.linear_blocks = list(blocks.values())
+        plan.allocate(self.resid.dtype)
+        plan.reset_best()
+        return plan
+
+    def solve_linear(self, values):
+        """Solves the projected parameters for the other values; returns (values with the solution filled in,
+        residual vector)"""
+        values = values.copy()
+        values[self.linear_idx] = 0
+        resid = np.zeros(self.resid.size)
+        for block in self.linear_blocks:
+            columns = sorted(set(n for i in block for n in self.p_index[i] if n in self.linear_idx))
+            col = {n: j for j, n in enumerate(columns)}
+            A = [np.zeros((len(self.y[i]), len(columns))) for i in block]
+            b = []
+            for k, i in enumerate(block):
+                model = self.models[i]
+                P = values[self.p_index[i]]
+                args = (self.y[i], self.z[i], self.ir_x[i], self.ir_y[i], self.ir_z[i])
+                base = model(self.x[i], P, *args)
+                w = self.weights[i] if self.weights[i] is not None else 1
+                b.append((self.y[i] - base) * w)
+                # the model is affine in the projected parameters: its derivatives are the basis columns, or one
+                # model evaluation per parameter without an analytic Jacobian
+                J = model.jacobian(self.x[i], P, *args) if model.has_jacobian else None
+                for n, root in enumerate(self.p_index[i]):
+                    if root in col:
+                        if J is None:
+                            P[n] = 1
+                            A[k][:, col[root]] += (model(self.x[i], P, *args) - base) * w
+                            P[n] = 0
+                        else:
+                            A[k][:, col[root]] += J[n] * w
+            A = np.concatenate(A)
+            b = np.concatenate(b)
+            finite = np.isfinite(b) & np.isfinite(A).all(axis=1)
+            beta = np.linalg.lstsq(A[finite], b[finite], rcond=None)[0]
+            where = np.searchsorted(self.linear_idx, columns)
+            lo, hi = self.linear_bounds[0][where], self.linear_bounds[1][where]
+            if np.any(beta < lo) or np.any(beta > hi):
+                beta = scipy.optimize.lsq_linear(A[finite], b[finite], bounds=(lo, hi), method='bvls').x
+            values[columns] = beta
+            fitted = b - A @ beta
+            start = 0
+            for i in block:
+                self.segment(resid, i)[:] = fitted[start:start + len(self.y[i])]
+                start += len(self.y[i])
+        return values, resid
+
+    def values(self, params):
+        """Returns the parameter values as an array ordered as the plan's names"""
+        return np.fromiter((par.value for par in params.values()), dtype=float, count=len(self.names))
+
+    def __call__(self, params):
+        if self.trace is None:
+            return self.residual(params)
+        start = time.perf_counter()
+        resid = self.residual(params)
+        self.trace.add_eval(time.perf_counter() - start, self.sumsq)
+        return resid
+
+    def residual(self, params):
+        """Weighted residual vector at params; also tracks the lowest sum of squares seen for restore_best"""
+        values = self.values(params)
+        dtype = self.resid.dtype
+        if getattr(self, 'linear_idx', None) is not None:
+            values, resid = self.solve_linear(values)
+            sumsq = self.sumsq = np.nansum(resid * resid)
+            if sumsq < self.best_sumsq:
+                self.best_sumsq = sumsq
+                self.best_values = values
+            return resid
+        resid = self.resid
+        for i, model in enumerate(self.models):
+            R = model(self.x[i], values[self.p_index[i]].astype(dtype, copy=False), self.y[i], self.z[i],
+                      self.ir_x[i], self.ir_y[i], self.ir_z[i])
+            out = resid[self.offsets[i]:self.offsets[i + 1]]
+            np.subtract(self.y[i], R, out=out)
+            if self.weights[i] is not None:
+                out *= self.weights[i]
+        # copy so results never alias the plan; single precision residuals are promoted so chi-square accumulates
+        # in double precision
+        resid = resid.copy() if dtype == float else resid.astype(float)
+        sumsq = self.sumsq = np.nansum(resid * resid)
+        if sumsq < self.best_sumsq:
+            self.best_sumsq = sumsq
+            self.best_values = values
+        return resid
+
+    def set_reference(self, values):
+        """Stores the model and raw residuals (y - model) of each buffer at parameter values, the best fit that
+        resampled() perturbs.  sigma is the buffer's y error when it has one, otherwise the residual spread"""
+        self.ref_model = []
+        self.ref_resid = []
+        self.ref_sigma = []
+        for i, model in enumerate(self.models):
+            R = model(self.x[i], values[self.p_index[i]], self.y[i], self.z[i], self.ir_x[i], self.ir_y[i],
+                      self.ir_z[i])
+            resid = self.y[i] - R
+            self.ref_model.append(R)
+            self.ref_resid.append(resid[np.isfinite(resid)])
+            self.ref_sigma.append(self.weights[i] if self.weights[i] is not None else np.std(self.ref_resid[-1]))
+
+    def resampled(self, method, seed):
+        """Copy of the plan fitting a synthetic data set: the reference model plus residuals drawn with replacement
+        (method 'boot') or gaussian noise of width sigma (method 'mc').  seed makes each replicate reproducible
+        wherever it is run"""
+        rng = np.random.default_rng(seed)
+        plan = copy.copy(self)
+        plan.y = []
+        for R, resid, sigma in zip(self.ref_model, self.ref_resid, self.ref_sigma):
+            noise = rng.normal(0, 1, len(R)) * sigma if method == 'mc' else rng.choice(resid, len(R))
+            plan.y.append((R + noise).astype(self.resid.dtype))
+        plan.allocate(self.resid.dtype)
+        plan.reset_best()
+        return plan
+
+    def reset_best(self):
+        """Forgets the lowest residual seen, called before each minimize"""
+        self.best_sumsq = np.inf
+        self.best_values = None
+
+    def restore_best(self, result, omit_nan=True):
+        """lmfit leaves an aborted fit at whatever point MINPACK last handed it, which need not be the best one and
+        can be a reused work array.  Resets the free parameters of an aborted result to the lowest residual
+        evaluated and recalculates its statistics"""
+        if not result.aborted or self.best_values is None:
+            return result
+        for name, value in zip(self.names, self.best_values):
+            if result.params[name].vary and result.params[name].expr is None:
+                result.params[name].value = value
+        result.params.update_constraints()
+        resid = self(result.params)
+        result.residual = resid[np.isfinite(resid)] if omit_nan else resid
+        result._calculate_statistics()
+        return result
+
+    def expand_residual(self, result):
+        """lmfit's nan_policy='omit' drops non-finite residuals, so result.residual no longer lines up with offsets.
+        Puts NaN back where the residual at the fitted values is not finite"""
+        if len(result.residual) == self.offsets[-1]:
+            return result
+        finite = np.isfinite(self.residual(result.params))
+        if np.count_nonzero(finite) == len(result.residual):
+            resid = np.full(self.offsets[-1], np.nan)
+            resid[finite] = result.residual
+            result.residual = resid
+        return result
+
+    def estimate_errors(self, result):
+        """Standard errors and correlations for a fit stopped before lmfit could estimate them: covariance from the
+        Jacobian at the result (analytic when available, otherwise forward differences) scaled by the reduced
+        chi-square, as leastsq does"""
+        names = result.var_names
+        params = copy.deepcopy(result.params)
+        base = self.residual(params)
+        if self.has_jacobian:
+            J = self.jacobian(params)
+        else:
+            J = np.zeros((len(names), base.size))
+            for n, name in enumerate(names):
+                value = params[name].value
+                step = np.sqrt(np.finfo(self.resid.dtype).eps) * max(abs(value), 1.0)
+                params[name].value = value + step
+                params.update_constraints()
+                J[n] = (self.residual(params) - base) / step
+                params[name].value = value
+            params.update_constraints()
+        J = np.nan_to_num(J[:, np.isfinite(base)])
+        try:
+            covar = np.linalg.inv(J @ J.T) * result.redchi
+        except np.linalg.LinAlgError:
+            return result
+        result.covar = covar
+        result.errorbars = bool(np.all(np.diag(covar) > 0))
+        for par in result.params.values():
+            par.stderr, par.correl = 0, None
+        stderr = np.sqrt(np.abs(np.diag(covar)))
+        for n, name in enumerate(names):
+            result.params[name].stderr = stderr[n]
+            result.params[name].correl = {other: covar[n, m] / (stderr[n] * stderr[m])
+                                          for m, other in enumerate(names) if m != n and stderr[n] * stderr[m] > 0}
+        return result
+
+    def jacobian(self, params):
+        """Returns d(residual)/d(free parameter) with shape (nfree, nresid), i.e. col_deriv=True for leastsq"""
+        start = time.perf_counter()
+        values = self.values(params)
+        jac = np.zeros((self.nfree, self.resid.size))
+        for i, model in enumerate(self.models):
+            J = model.jacobian(self.x[i], values[self.p_index[i]].astype(self.resid.dtype, copy=False), self.y[i],
+                               self.z[i], self.ir_x[i], self.ir_y[i], self.ir_z[i])
+            if self.weights[i] is not None:
+                J = J * self.weights[i]
+            for n, row in enumerate(self.jac_rows[self.p_index[i]]):
+                if row >= 0:
+                    jac[row, self.offsets[i]:self.offsets[i + 1]] -= J[n]
+        jac = np.nan_to_num(jac)
+        if self.trace is not None:
+            self.trace.add_jacobian(time.perf_counter() - start)
+        return jac
+
+    def sparse_jacobian(self, x, *args, **kwargs):
+        """Analytic Jacobian (nresid, nfree) as a sparse matrix, called by scipy least_squares with the free
+        parameter vector x.  Only valid when has_jacobian, i.e. all links are identities"""
+        start = time.perf_counter()
+        values = self.start.copy()
+        values[self.free_idx] = x
+        values = values[self.root]
+        rows = [np.zeros(0, dtype=int)]
+        cols = [np.zeros(0, dtype=int)]
+        data = [np.zeros(0)]
+        for i, model in enumerate(self.models):
+            J = model.jacobian(self.x[i], values[self.p_index[i]].astype(self.resid.dtype, copy=False), self.y[i],
+                               self.z[i], self.ir_x[i], self.ir_y[i], self.ir_z[i])
+            if self.weights[i] is not None:
+                J = J * self.weights[i]
+            for n, row in enumerate(self.jac_rows[self.p_index[i]]):
+                if row >= 0:
+                    rows.append(np.arange(self.offsets[i], self.offsets[i + 1]))
+                    cols.append(np.full(len(J[n]), row))
+                    data.append(-1 * np.nan_to_num(J[n]))
+        # duplicate entries (parameters linked within one buffer) are summed by the sparse constructor
+        jac = scipy.sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                      shape=(self.resid.size, self.nfree))
+        if self.trace is not None:
+            self.trace.add_jacobian(time.perf_counter() - start)
+        return jac
+
+
+class FitTrace(object):
+    """Instrumentation of one group's fit: objective and Jacobian evaluation counts and times and the chi-square of
+    every objective evaluation, in order.  Times include the EvalPlan bookkeeping around the models"""
+    def __init__(self):
+        self.nfev = 0
+        self.njev = 0
+        self.model_time = 0.0
+        self.jacobian_time = 0.0
+        self.chisqr = []
+
+    def add_eval(self, seconds, sumsq):
+        self.nfev += 1
+        self.model_time += seconds
+        self.chisqr.append(float(sumsq))
+
+    def add_jacobian(self, seconds):
+        self.njev += 1
+        self.jacobian_time += seconds
+
+
+class ConvergenceController(object):
+    """Early stopping for fit -chitol/-ptol/-budget, passed to minimize as iter_cb.  Every window evaluations (about
+    one finite difference Jacobian and a step) the lowest chi-square so far and its parameters are compared with
+    the previous checkpoint.  The fit stops when the relative chi-square improvement stays below chisqr_tol, or the
+    largest relative change of a free parameter below param_tol, for patience checkpoints in a row, or once the
+    group has run for budget seconds since start.  reason names the criterion that stopped it"""
+    def __init__(self, chisqr_tol=None, param_tol=None, budget=None, start=None, chained=None, patience=2):
+        self.chisqr_tol = chisqr_tol
+        self.param_tol = param_tol
+        self.budget = budget
+        self.start = time.perf_counter() if start is None else start
+        self.chained = chained
+        self.patience = patience
+        self.reason = None
+        self.nfev = 0
+        self.names = None
+        self.best = np.inf
+        self.best_values = None
+        self.checkpoint = None
+        self.stalled = 0
+
+    def __call__(self, params, nfev, resid, *args, **kwargs):
+        if self.chained is not None:
+            self.chained(params, nfev, resid, *args, **kwargs)
+        if self.reason is not None:
+            return True
+        if self.names is None:
+            self.names = [name for name, par in params.items() if par.vary and par.expr is None]
+            self.window = len(self.names) + 2
+        self.nfev += 1
+        sumsq = np.nansum(resid * resid)
+        if sumsq < self.best:
+            self.best = sumsq
+            self.best_values = np.array([params[name].value for name in self.names])
+        if self.budget is not None and time.perf_counter() - self.start > self.budget:
+            self.reason = 'time budget'
+        elif self.nfev % self.window == 0 and self.best_values is not None:
+            if self.checkpoint is not None:
+                best, values = self.checkpoint
+                change = np.abs(self.best_values - values) / np.maximum(np.abs(values), 1E-300)
+                if self.chisqr_tol is not None and best - self.best <= self.chisqr_tol * best:
+                    self.stalled += 1
+                    reason = 'chi-square plateau'
+                elif self.param_tol is not None and (len(change) == 0 or change.max() <= self.param_tol):
+                    self.stalled += 1
+                    reason = 'parameter change'
+                else:
+                    self.stalled = 0
+                if self.stalled >= self.patience:
+                    self.reason = reason
+            self.checkpoint = (self.best, self.best_values)
+        return self.reason is not None
+
+
 def eval_objective(params, y_matrix, idx, param_dict):  # calculate residuals to determine if the parameters are improving the fit
     '''param_dict = param_dict = {'x_vec': X_vec, 'y_vec': Y_vec, 'z_vec': Z_vec, 'p_vec':P_vec, 'y_matrix': Y_matrix,
                           'ir_x_vec': IR_X_vec, 'ir_y_vec': IR_Y_vec, 'ir_z_vec': IR_Z_vec,
                           'weights_vec': WEIGHTS_vec, 'fxn_vec': FXN_vec, 'fxn_num_vec': FXN_NUM_vec,
-                          'param_id_vec': PARAM_ID_vec,'method': method, 'debug': debug, 'group': group, 'cpu': cpu,
-                          'ind_fit': ind_fit, 'iter_cb': iter_cb, 'max_iter': max_iter}'''
-    resid = 0.0 * y_matrix[:]
-    group = param_dict['group']
-    x_vec = param_dict['x_vec'][idx]
-    y_vec = param_dict['y_vec'][idx]
-    z_vec = param_dict['z_vec'][idx]
-    p_vec = param_dict['p_vec'][idx]
-    ir_x_vec = param_dict['ir_x_vec'][idx]
-    ir_y_vec = param_dict['ir_y_vec'][idx]
-    ir_z_vec = param_dict['ir_z_vec'][idx]
-    fxn_vec = param_dict['fxn_vec'][idx]
-    weights_vec = param_dict['weights_vec'][idx]
-    fxn_num_vec = param_dict['fxn_num_vec'][idx]
-    pyscript_vec = []
-    param_id_vec = []
-    for fxn_num in fxn_num_vec:
-        temp_df = datafit(fxn_num)
-        temp_df.update(fxn_num)
-        pyscript_vec.append(temp_df.pyscript)
-        param_id_vec.append(temp_df.paramid)
-    for i in range(len(x_vec)):
-        P = []
-        X = x_vec[i]
-        Y = y_vec[i]
-        Z = z_vec[i]
-        IRX = ir_x_vec[i]
-        IRY = ir_y_vec[i]
-        IRZ = ir_z_vec[i]
-        weights = weights_vec[i]
-
-        # Fit the data
-        fxn = fxn_vec[i]
-        R = [0] * len(X)
-        for j in range(len(param_id_vec[i])):
-            pname = param_id_vec[i][j].replace('-', '') + "_{}_{}".format(j + 1, i+(idx*group)+1)
-            P.append(params[pname].value)
-        if fxn is not False and fxn[:2].upper() == "Y=":
-            fxn = fxn[2:]
-        # execute custom script
-        if pyscript_vec[i]:
-            exec(pyscript_vec[i])
-        else:
-            R = eval(str(fxn))
+                          'model_vec': MODEL_vec, 'plan_vec': PLAN_vec, 'param_id_vec': PARAM_ID_vec,
+                          'method': method, 'debug': debug, 'group': group, 'cpu': cpu, 'ind_fit': ind_fit,
+                          'iter_cb': iter_cb, 'max_iter': max_iter, 'sparse': sparse, 'shm': shm}'''
+    return param_dict['plan_vec'][idx](params)
 
-        p_vec = P
-        R = np.array(R)
 
-        resid_line = (Y - R) if len(weights) <= 1 else (Y - R) * weights
-        resid[i, :] = resid_line
-    # now flatten this to a 1D array, as minimize() needs
-    return resid.flatten()
+def eval_jacobian(params, y_matrix, idx, param_dict):
+    """Analytic Jacobian of eval_objective, passed to leastsq as Dfun when every model in the group declares it.
+    Columns of non-finite residuals are left out, as nan_policy='omit' leaves out the residuals"""
+    plan = param_dict['plan_vec'][idx]
+    jac = plan.jacobian(params)
+    # leastsq asks for the Jacobian at the point it evaluated last
+    finite = np.isfinite(plan.resid)
+    return jac if finite.all() else jac[:, finite]
 
 
 def optimizer(param_dict, idx_list):
     result = []
     for idx in idx_list:
-        print(f'Evaluating #{idx+1} from total pool of: {len(param_dict["y_vec"])}')
-        parameters = param_dict['p_vec'][idx]
-        iter_cb = param_dict['iter_cb']
-        max_iter = iter_cb = param_dict['max_iter']
-        method = iter_cb = param_dict['method']
-        argsx = (param_dict['y_matrix'][idx], idx, param_dict)
-        result.append(minimize(eval_objective, parameters, args=(param_dict['y_matrix'][idx], idx, param_dict),
-                 iter_cb=iter_cb, method=method, maxfev=max_iter, nan_policy='omit'))
+        print(f'Evaluating #{param_dict["group_index"][idx]+1 if "group_index" in param_dict else idx+1} from total pool of: '
+              f'{param_dict.get("total_groups", len(param_dict["y_vec"]))}')
+        result.append(fit_group(param_dict, idx))
+    return result
+
+
+def fit_group(param_dict, idx):
+    """Fits group idx of param_dict starting from param_dict['p_vec'][idx] and returns the lmfit result"""
+    parameters = param_dict['p_vec'][idx]
+    iter_cb = param_dict['iter_cb']
+    max_iter = param_dict['max_iter']
+    method = param_dict['method']
+    argsx = (param_dict['y_matrix'][idx], idx, param_dict)
+    base_plan = plan = param_dict['plan_vec'][idx]
+    if param_dict.get('replicate_vec') is not None:
+        # resampled data set for uncertainty estimates, regenerated here from its seed
+        plan = param_dict['plan_vec'][idx] = plan.resampled(*param_dict['replicate_vec'][idx])
+    # copies made for the multires and varpro passes share the trace, so it covers every stage of the fit
+    trace = plan.trace = FitTrace()
+    started, wall_start = time.time(), time.perf_counter()
+    multires = varpro = None
+    if param_dict.get('multires') is not None:
+        # fit decimated traces first, then refine at full resolution on a reduced budget
+        multires = multires_fit(param_dict, idx, parameters)
+        if multires is not None:
+            parameters = multires.params
+    if param_dict.get('varpro') and not param_dict['sparse'] and multires is None:
+        # fit the nonlinear parameters first, then refine everything from there for the full covariance
+        varpro = varpro_fit(param_dict, idx, parameters)
+        if varpro is not None:
+            parameters = varpro.params
+    if param_dict['sparse']:
+        # trust-region solver sees the block structure of the group: analytic sparse Jacobian when
+        # available, otherwise finite differences restricted to the sparsity pattern
+        plan.start = plan.values(parameters)
+        fit_kws = {'tr_solver': 'lsmr', 'x_scale': 'jac', 'max_nfev': max_iter, 'nan_policy': 'propagate'}
+        if plan.has_jacobian:
+            fit_kws['jac'] = plan.sparse_jacobian
+        else:
+            fit_kws['jac_sparsity'] = plan.sparsity()
+            if plan.resid.dtype != float:
+                fit_kws['diff_step'] = np.sqrt(np.finfo(plan.resid.dtype).eps)
+    else:
+        # analytic Jacobian when available, otherwise leastsq falls back to finite differences.  max_iter counts
+        # iterations of nfree + 1 evaluations, which for the default 2000 is lmfit's own limit
+        nfree = len([par for par in parameters.values() if par.vary and par.expr is None])
+        fit_kws = {'max_nfev': max_iter * (nfree + 1), 'nan_policy': 'omit'}
+        if method.lower() == 'leastsq' and plan.has_jacobian:
+            fit_kws.update({'Dfun': eval_jacobian, 'col_deriv': True})
+        elif method.lower() == 'leastsq':
+            fit_kws.update(plan.fd_kws())
+    max_nfev = fit_kws['max_nfev']
+    if param_dict.get('max_nfev') is not None:
+        # hard evaluation budget: lmfit aborts the fit but keeps the best values reached
+        fit_kws['max_nfev'] = param_dict['max_nfev']
+    elif multires is not None:
+        fit_kws['max_nfev'] = 10 * (len([par for par in parameters.values() if par.vary and par.expr is None]) + 1)
+    controller = None
+    if param_dict.get('converge') is not None:
+        # the time budget runs from the start of the group, including any multires or varpro pass
+        controller = iter_cb = ConvergenceController(*param_dict['converge'], start=wall_start, chained=iter_cb)
+    refine_start = trace.nfev
+    start = time.perf_counter()
+    plan.reset_best()
+    result = minimize(eval_objective, parameters, args=(param_dict['y_matrix'][idx], idx, param_dict),
+                      iter_cb=iter_cb, method=method, **fit_kws)
+    plan.restore_best(result, fit_kws['nan_policy'] == 'omit')
+    stopped = controller is not None and controller.reason is not None
+    if multires is not None and result.aborted and param_dict.get('max_nfev') is None and not stopped:
+        # the coarse solution was not close enough: finish with the normal budget
+        nfev = result.nfev
+        fit_kws['max_nfev'] = max_nfev
+        plan.reset_best()
+        result = minimize(eval_objective, result.params, args=(param_dict['y_matrix'][idx], idx, param_dict),
+                          iter_cb=iter_cb, method=method, **fit_kws)
+        plan.restore_best(result, fit_kws['nan_policy'] == 'omit')
+        result.nfev += nfev
+        stopped = controller is not None and controller.reason is not None
+    if stopped:
+        # an early stop is a usable fit at the best parameters reached; lmfit leaves it without error bars
+        result.stop_reason = controller.reason
+        result.aborted, result.success = False, True
+        result.message = f'Fit stopped early: {controller.reason}.'
+        plan.estimate_errors(result)
+    elif result.aborted and param_dict.get('max_nfev') is None:
+        # fit N ran out of iterations: keep the best parameters reached, flagged as not converged
+        result.stop_reason = 'iteration limit'
+        result.aborted = False
+        result.message = f'Fit reached the iteration limit ({max_iter}) before converging.'
+        plan.estimate_errors(result)
+    else:
+        result.stop_reason = 'evaluation limit' if result.aborted else 'converged' if result.success else 'not converged'
+    result.fit_time = time.perf_counter() - start
+    if multires is not None:
+        # coarse pass cost and how far refinement moved each free parameter from the coarse solution
+        shift = [abs(result.params[name].value - parameters[name].value) / max(abs(result.params[name].value), 1E-300)
+                 for name in parameters if parameters[name].vary and parameters[name].expr is None]
+        result.multires = {'npts': multires.npts, 'coarse_time': multires.fit_time, 'coarse_nfev': multires.nfev,
+                           'refine_time': result.fit_time, 'refine_nfev': result.nfev,
+                           'max_shift': max(shift) if len(shift) > 0 else 0.0}
+        result.fit_time += multires.fit_time
+    if varpro is not None:
+        result.varpro_nfev = varpro.nfev
+        result.fit_time += varpro.fit_time
+    plan.expand_residual(result)
+    plan.restore_aliases(result.params)
+    result.offsets = base_plan.offsets
+    plan.trace = None
+    result.telemetry = fit_telemetry(param_dict, idx, plan, result, trace, started,
+                                     time.perf_counter() - wall_start, refine_start)
+    # call_kws keeps the Minimizer's bound Jacobian wrapper, which can not be pickled back from a worker
+    result.call_kws = {key: val for key, val in result.call_kws.items() if not callable(val)}
+    param_dict['plan_vec'][idx] = base_plan
+    if param_dict.get('compact'):
+        # parameter values and statistics only
+        result = FitSummary(result)
+        result.residual = None
+    return result
+
+
+def model_name(model):
+    """Function index of a model, or 'i+j' for a combination"""
+    index = getattr(model, 'fxn_index', ())
+    return index[0] if len(index) == 1 else '+'.join(str(f) for f in index)
+
+
+def fit_telemetry(param_dict, idx, plan, result, trace, started, wall_time, refine_start):
+    """Record of group idx's fit for FitTelemetry.  chisqr holds the sum of squares of every objective evaluation,
+    including the multires and varpro passes (the full fit starts at refine_start); solver_time is the wall time
+    not spent evaluating the models or their Jacobians"""
+    group = param_dict['group_index'][idx] if 'group_index' in param_dict else idx
+    # param_dicts built outside build_fit (verify_precision) have no buffer numbering
+    first = param_dict.get('bmin', 1) + group * param_dict.get('group', len(plan.models))
+    return {'group': group + 1, 'buffers': [first + j for j in range(len(plan.models))],
+            'functions': [model_name(model) for model in plan.models],
+            'npts': int(plan.resid.size), 'nfree': int(result.nvarys),
+            'method': 'least_squares' if param_dict['sparse'] else param_dict['method'],
+            'started': started, 'wall_time': wall_time, 'nfev': trace.nfev, 'njev': trace.njev,
+            'model_time': trace.model_time, 'jacobian_time': trace.jacobian_time,
+            'solver_time': max(wall_time - trace.model_time - trace.jacobian_time, 0.0),
+            'chisqr': trace.chisqr, 'refine_start': refine_start, 'final_chisqr': float(result.chisqr),
+            'success': bool(result.success), 'aborted': bool(result.aborted), 'stop_reason': result.stop_reason,
+            'worker': mp.current_process().name, 'pid': os.getpid()}
+
+
+def multires_fit(param_dict, idx, parameters):
+    """Coarse pass of fit -multires: fits group idx on a decimated copy of its data (EvalPlan.decimated) that keeps
+    the phase boundaries, with variable projection when -varpro is set.  Returns the result with params holding
+    the coarse solution for the full parameter set, or None when the traces are too short to decimate"""
+    base_plan = param_dict['plan_vec'][idx]
+    stride = param_dict['multires'] or max(np.diff(base_plan.offsets)) // 1000
+    plan = base_plan.decimated(stride, param_dict['lines_vec'][idx])
+    if plan is None:
+        return None
+    start = time.perf_counter()
+    param_dict['plan_vec'][idx] = plan
+    try:
+        result = varpro_fit(param_dict, idx, parameters) if param_dict.get('varpro') else None
+        if result is None:
+            fit_kws = {'Dfun': eval_jacobian, 'col_deriv': True} if plan.has_jacobian else plan.fd_kws()
+            result = minimize(eval_objective, parameters, args=(param_dict['y_matrix'][idx], idx, param_dict),
+                              method='leastsq', nan_policy='omit', **fit_kws)
+            plan.restore_best(result)
+    finally:
+        param_dict['plan_vec'][idx] = base_plan
+    params = copy.deepcopy(parameters)
+    for name in params:
+        if params[name].vary and params[name].expr is None:
+            params[name].value = result.params[name].value
+    result.params = params
+    result.npts = (plan.resid.size, base_plan.resid.size)
+    result.fit_time = time.perf_counter() - start
+    return result
+
+
+def varpro_fit(param_dict, idx, parameters):
+    """Variable projection fit of group idx: parameters the models are linear in are solved exactly inside each
+    evaluation (EvalPlan.project), so leastsq only varies the rest.  Returns the result with every parameter at
+    its projected solution, or None when nothing in the group can be projected"""
+    base_plan = param_dict['plan_vec'][idx]
+    plan = base_plan.project(parameters)
+    if plan is None:
+        return None
+    reduced = copy.deepcopy(parameters)
+    for n in plan.linear_idx:
+        reduced[plan.names[n]].vary = False
+    start = time.perf_counter()
+    param_dict['plan_vec'][idx] = plan
+    try:
+        result = minimize(eval_objective, reduced, args=(param_dict['y_matrix'][idx], idx, param_dict),
+                          method='leastsq', max_nfev=param_dict['max_iter'] * (plan.nfree - len(plan.linear_idx) + 1),
+                          nan_policy='omit', **plan.fd_kws())
+        plan.restore_best(result)
+        values = plan.solve_linear(plan.values(result.params))[0]
+    finally:
+        param_dict['plan_vec'][idx] = base_plan
+    result.params = copy.deepcopy(parameters)
+    for name, value in zip(plan.names, values):
+        if result.params[name].vary and result.params[name].expr is None:
+            result.params[name].value = value
+    result.fit_time = time.perf_counter() - start
+    return result
+
+
+class StackedPlan(object):
+    """Evaluation plan of fit -batch: the single-buffer groups of an -ind fit stacked into (nbuf, npts) arrays.
+
+    When the model expression broadcasts over the stack (checked against buffer-by-buffer evaluation), one call
+    evaluates the model or its analytic Jacobian for every buffer; otherwise buffers are evaluated one at a time
+    into the same arrays.  Without analytic derivatives the Jacobian is a forward difference taken for all
+    buffers at once.  NaN data points carry zero weight.  x, y and weights are the buffers' data as passed to
+    build_fit, so the stack is evaluated in double precision even when the plans hold -f32 copies.
+    """
+    def __init__(self, plans, p_vec, x, y, weights):
+        self.plans = plans
+        self.model = plans[0].models[0]
+        self.names = [plan.names for plan in plans]
+        self.x = np.array(x, dtype=float)
+        self.y = np.array(y, dtype=float)
+        weights = np.array([w if len(w) > 1 else np.ones(len(y_b)) for w, y_b in zip(weights, y)], dtype=float)
+        self.mask = np.isfinite(self.y) & np.isfinite(weights)
+        self.weights = np.where(self.mask, weights, 0.0)
+        self.data = np.where(self.mask, self.y, 0.0)
+        self.p = np.array([plan.values(params) for plan, params in zip(plans, p_vec)])
+        self.free = np.array([[par.vary for par in params.values()] for params in p_vec], dtype=bool)
+        self.lo = np.array([[par.min for par in params.values()] for params in p_vec], dtype=float)
+        self.hi = np.array([[par.max for par in params.values()] for params in p_vec], dtype=float)
+        self.model_time = self.jacobian_time = 0.0
+        self.vectorized = self.__broadcasts(self.model.stacked, self.__model_rows)
+        self.vectorized_jacobian = self.model.has_jacobian and \
+            self.__broadcasts(self.model.stacked_jacobian, self.__jacobian_rows)
+
+    def __broadcasts(self, stacked, by_row):
+        rows = np.unique([0, len(self.plans) - 1])
+        R = stacked(self.x[rows], self.p[rows], self.y[rows])
+        return R is not None and np.allclose(R, by_row(rows, self.p[rows]), rtol=1E-10, atol=0, equal_nan=True)
+
+    def __model_rows(self, rows, P):
+        return np.array([self.model(self.x[b], p, self.y[b], self.plans[b].z[0], self.plans[b].ir_x[0],
+                                    self.plans[b].ir_y[0], self.plans[b].ir_z[0]) for b, p in zip(rows, P)],
+                        dtype=float)
+
+    def __jacobian_rows(self, rows, P):
+        return np.array([self.model.jacobian(self.x[b], p, self.y[b], self.plans[b].z[0], self.plans[b].ir_x[0],
+                                             self.plans[b].ir_y[0], self.plans[b].ir_z[0]) for b, p in zip(rows, P)],
+                        dtype=float)
+
+    def evaluate(self, rows, P):
+        """Model values of buffers rows at parameters P (one row of P per buffer)"""
+        start = time.perf_counter()
+        R = self.model.stacked(self.x[rows], P, self.y[rows]) if self.vectorized else self.__model_rows(rows, P)
+        self.model_time += time.perf_counter() - start
+        return R
+
+    def residual(self, rows, P):
+        """Weighted residuals of buffers rows, zero at NaN data points"""
+        return np.where(self.mask[rows], (self.data[rows] - self.evaluate(rows, P)) * self.weights[rows], 0.0)
+
+    def jacobian(self, rows, P, resid=None):
+        """Jacobian of the weighted residuals, (len(rows), nparams, npts); columns of fixed parameters are zero.
+        Forward differences need the residuals at P"""
+        start = time.perf_counter()
+        free = self.free[rows]
+        if self.model.has_jacobian:
+            J = self.model.stacked_jacobian(self.x[rows], P, self.y[rows]) if self.vectorized_jacobian else \
+                self.__jacobian_rows(rows, P)
+            J *= -self.weights[rows][:, None, :]
+            if not self.mask[rows].all():
+                J[np.broadcast_to(~self.mask[rows][:, None, :], J.shape)] = 0.0
+        else:
+            J = np.zeros((len(rows), P.shape[1], self.x.shape[1]))
+            for n in np.flatnonzero(free.any(axis=0)):
+                # MINPACK's default step, taken downwards at an upper bound
+                h = 1.4901161193847656E-08 * np.where(P[:, n] != 0, np.abs(P[:, n]), 1.0)
+                h = np.where(P[:, n] + h > self.hi[rows, n], -h, h)
+                Pn = P.copy()
+                Pn[:, n] += h
+                J[:, n] = (self.residual(rows, Pn) - resid) / h[:, None]
+        J *= free[:, :, None]
+        self.jacobian_time += time.perf_counter() - start
+        return J
+
+
+def batch_incompatible(param_dict):
+    """Reason fit -batch can not stack the groups of param_dict, or None"""
+    plans, p_vec = param_dict['plan_vec'], param_dict['p_vec']
+    if param_dict['group'] != 1:
+        return 'needs -ind'
+    flags = [flag for flag, on in (('-sparse', param_dict['sparse']), ('-varpro', param_dict['varpro']),
+                                   ('-multires', param_dict['multires'] is not None), ('-warm', param_dict['warm']),
+                                   ('-multistart', param_dict['multistart'] > 1),
+                                   ('-chitol/-ptol/-budget', param_dict['converge'] is not None)) if on]
+    if len(flags) > 0:
+        return 'not combined with ' + ', '.join(flags)
+    model = plans[0].models[0]
+    for plan, params in zip(plans, p_vec):
+        if not isinstance(plan.models[0], CompiledModel) or \
+                (plan.models[0].fxn_index, plan.models[0].expression) != (model.fxn_index, model.expression):
+            return 'buffers use different functions or -irf'
+        if len(plan.y[0]) != len(plans[0].y[0]):
+            return 'buffers differ in length'
+        if len(plan.aliases) > 0 or any(par.expr is not None for par in params.values()):
+            return 'parameters are linked'
+    return None
+
+
+def batch_fit(param_dict, ftol=1.5E-8, xtol=1.5E-8, progress=None):
+    """fit -batch: one Levenberg-Marquardt iteration across the stacked buffers of an -ind fit (StackedPlan).
+    Every buffer keeps its own damping and leaves the stack as soon as it converges, so the remaining iterations
+    only evaluate the buffers still moving.  Bounds are enforced by clipping the step, and parameters pinned at
+    a bound are held for the iteration.  max_iter counts Jacobian evaluations.  progress(param_dict, [], []) is
+    called before every iteration so a FitCancelled raised from it stops the fit; the groups finish together, so
+    their results are only reported by the caller.  Returns a FitSummary per group, or a string saying why the
+    groups can not be batched"""
+    reason = batch_incompatible(param_dict)
+    if reason is not None:
+        return reason
+    started, wall_start = time.time(), time.perf_counter()
+    stack = StackedPlan(param_dict['plan_vec'], param_dict['p_vec'], *[[vec[0] for vec in param_dict[key]]
+                                                                        for key in ('x_vec', 'y_vec', 'weights_vec')])
+    nbuf, npar = stack.p.shape
+    P, free = stack.p.copy(), stack.free
+    every = np.arange(nbuf)
+    resid = stack.residual(every, P)
+    chisqr = np.sum(resid * resid, axis=1)
+    lam = np.full(nbuf, 1E-3)
+    nfev, njev = np.ones(nbuf, dtype=int), np.zeros(nbuf, dtype=int)
+    history = [[float(c)] for c in chisqr]
+    stop = np.array(['converged'] * nbuf, dtype=object)
+    active = free.any(axis=1) & np.isfinite(chisqr)
+    stop[~np.isfinite(chisqr)] = 'not converged'
+    eye = np.eye(npar)
+    for _ in range(param_dict['max_iter']):
+        rows = np.flatnonzero(active)
+        if len(rows) == 0:
+            break
+        if progress is not None:
+            progress(param_dict, [], [])
+        J = stack.jacobian(rows, P[rows], resid[rows])
+        njev[rows] += 1
+        nfev[rows] += 0 if stack.model.has_jacobian else free[rows].any(axis=0).sum()
+        g = np.einsum('kpn,kn->kp', J, resid[rows])
+        # parameters the gradient holds against a bound are left out of this iteration's step
+        pinned = ((P[rows] <= stack.lo[rows]) & (g > 0)) | ((P[rows] >= stack.hi[rows]) & (g < 0))
+        J[pinned], g[pinned] = 0.0, 0.0
+        A = J @ J.transpose(0, 2, 1)
+        # Marquardt scaling; fixed and insensitive parameters get a unit diagonal so the system stays regular
+        scale = np.einsum('kpp->kp', A).copy()
+        scale[scale <= 0] = 1.0
+        pending = np.arange(len(rows))
+        while len(pending) > 0:
+            sub = rows[pending]
+            damped = A[pending] + (lam[sub][:, None] * scale[pending])[:, :, None] * eye
+            step = -np.linalg.solve(damped, g[pending][:, :, None])[..., 0]
+            trial = np.clip(P[sub] + step, stack.lo[sub], stack.hi[sub])
+            trial_resid = stack.residual(sub, trial)
+            trial_chisqr = np.sum(trial_resid * trial_resid, axis=1)
+            nfev[sub] += 1
+            better = trial_chisqr <= chisqr[sub]
+            accept = sub[better]
+            small_drop = chisqr[accept] - trial_chisqr[better] <= ftol * chisqr[accept]
+            small_step = np.all(np.abs(trial[better] - P[accept]) <= xtol * (np.abs(P[accept]) + xtol), axis=1)
+            P[accept], resid[accept], chisqr[accept] = trial[better], trial_resid[better], trial_chisqr[better]
+            # converged once a nearly undamped step no longer changes chi-square or the parameters
+            done = accept[(small_drop | small_step) & (lam[accept] <= 1.0)]
+            active[done] = False
+            lam[accept] = np.maximum(lam[accept] / 10, 1E-12)
+            reject = sub[~better]
+            lam[reject] *= 10
+            # no downhill step even with heavy damping: at the minimum to within rounding
+            active[reject[lam[reject] > 1E10]] = False
+            pending = pending[~better][lam[reject] <= 1E10]
+        for b in rows:
+            history[b].append(float(chisqr[b]))
+    stop[active] = 'iteration limit'
+
+    # covariance from the Jacobian at the solution, scaled by the reduced chi-square as lmfit does
+    J = stack.jacobian(every, P, resid)
+    ndata, nvarys = stack.mask.sum(axis=1), free.sum(axis=1)
+    redchi = chisqr / np.maximum(ndata - nvarys, 1)
+    A = J @ J.transpose(0, 2, 1)
+    A[~free] = 0.0
+    A[:, eye.astype(bool)] += ~free
+    stderr = np.full((nbuf, npar), np.nan)
+    for b in range(nbuf):
+        try:
+            stderr[b] = np.sqrt(np.abs(np.diag(np.linalg.inv(A[b]))) * redchi[b])
+        except np.linalg.LinAlgError:
+            pass
+    wall_time = time.perf_counter() - wall_start
+    logl = ndata * np.log(np.maximum(chisqr, 1E-250) / ndata)
+    share = nfev / nfev.sum()
+    results = []
+    for b, plan in enumerate(stack.plans):
+        converged = stop[b] == 'converged'
+        errors = [float(stderr[b, n]) if free[b, n] and np.isfinite(stderr[b, n]) else None if free[b, n] else 0.0
+                  for n in range(npar)]
+        telemetry = {'group': b + 1, 'buffers': [param_dict['bmin'] + b], 'functions': [model_name(stack.model)],
+                     'npts': int(stack.x.shape[1]), 'nfree': int(nvarys[b]), 'method': 'batch', 'started': started,
+                     'wall_time': wall_time * share[b], 'nfev': int(nfev[b]), 'njev': int(njev[b]),
+                     'model_time': stack.model_time * share[b], 'jacobian_time': stack.jacobian_time * share[b],
+                     'solver_time': max(wall_time - stack.model_time - stack.jacobian_time, 0.0) * share[b],
+                     'chisqr': history[b], 'refine_start': 0, 'final_chisqr': float(chisqr[b]),
+                     'success': bool(converged), 'aborted': False, 'stop_reason': stop[b],
+                     'worker': mp.current_process().name, 'pid': os.getpid()}
+        results.append(FitSummary.from_arrays(
+            plan.names, P[b], errors, np.where(stack.mask[b], resid[b], np.nan), nfev=int(nfev[b]),
+            ndata=int(ndata[b]), nvarys=int(nvarys[b]), chisqr=float(chisqr[b]), redchi=float(redchi[b]),
+            aic=float(logl[b] + 2 * nvarys[b]), bic=float(logl[b] + np.log(ndata[b]) * nvarys[b]),
+            message='Batch fit converged.' if converged else
+            f"Batch fit reached the iteration limit ({param_dict['max_iter']}) before converging."
+            if stop[b] == 'iteration limit' else 'Batch fit could not evaluate the model at the starting parameters.',
+            aborted=stop[b] == 'not converged', success=converged, fit_time=wall_time * share[b], telemetry=telemetry,
+            stop_reason=stop[b], offsets=plan.offsets))
+    return results
+
+
+def profile_chunk(param_dict, idx_list):
+    """Profile likelihood bounds.  Entry idx of param_dict['profile_vec'] is (name, direction, chisqr at the best
+    fit, target chisqr, step) for group idx, whose p_vec entry holds the best fit values.  name is fixed and walked
+    away from its best value in steps doubling from step until chisqr passes the target, refitting the other
+    parameters at each point warm started from the previous one; the crossing is then refined by regula falsi.
+    Returns one dict per entry with the bound, a status ('ok', 'bound' when the parameter limit is reached first,
+    'open' when no crossing is found) and the evaluation count and time"""
+    result = []
+    for idx in idx_list:
+        name, direction, chisqr0, target, step = param_dict['profile_vec'][idx]
+        start = time.perf_counter()
+        best = param_dict['p_vec'][idx]
+        params = copy.deepcopy(best)
+        params[name].vary = False
+        plan = param_dict['plan_vec'][idx]
+        param_dict['plan_vec'][idx] = plan.for_parameters(params)
+        state = {'nfev': 0}
+
+        def offset(value):
+            params[name].value = value
+            param_dict['p_vec'][idx] = params
+            fit = fit_group(param_dict, idx)
+            state['nfev'] += fit.nfev
+            # warm start the next point from this one
+            for key in params:
+                params[key].value = fit.params[key].value
+            return fit.chisqr - target
+
+        limit = params[name].max if direction > 0 else params[name].min
+        a, fa = best[name].value, chisqr0 - target
+        bound, status = np.nan, 'open'
+        try:
+            for k in range(16):
+                b = best[name].value + direction * step * 2 ** k
+                hit = (b - limit) * direction >= 0
+                b = limit if hit else b
+                fb = offset(b)
+                if fb >= 0:
+                    # Illinois regula falsi between the last point below the target and the first above it
+                    for _ in range(30):
+                        c = b - fb * (b - a) / (fb - fa)
+                        fc = offset(c)
+                        if abs(fc) < 1E-3 * (target - chisqr0):
+                            break
+                        if fc * fb < 0:
+                            a, fa = b, fb
+                        else:
+                            fa /= 2
+                        b, fb = c, fc
+                    bound, status = c, 'ok'
+                    break
+                if hit:
+                    bound, status = limit, 'bound'
+                    break
+                a, fa = b, fb
+        finally:
+            param_dict['p_vec'][idx] = best
+            param_dict['plan_vec'][idx] = plan
+        result.append({'name': name, 'direction': direction, 'bound': float(bound), 'status': status,
+                       'nfev': state['nfev'], 'time': time.perf_counter() - start})
     return result
 
 
-def multi_fit(param_dict):
+def run_chunk(param_dict, idx_list):
+    """Runs the groups idx_list of param_dict: profile likelihood bounds when the dict carries a profile_vec,
+    otherwise fits"""
+    if param_dict.get('profile_vec') is not None:
+        return profile_chunk(param_dict, idx_list)
+    return optimizer(param_dict, idx_list)
+
+
+class FitSummary(object):
+    """Compact fit result returned by shared memory workers: parameter values and errors as arrays plus the fit
+    statistics dofit reports.  params is rebuilt as lmfit Parameters on first access"""
+    attrs = ('nfev', 'ndata', 'nvarys', 'chisqr', 'redchi', 'aic', 'bic', 'message', 'aborted', 'success',
+             'fit_time', 'varpro_nfev', 'multires', 'telemetry', 'stop_reason', 'offsets')
+
+    def __init__(self, result):
+        self.names = list(result.params.keys())
+        self.values = np.array([result.params[name].value for name in self.names])
+        self.stderr = [result.params[name].stderr for name in self.names]
+        self.residual = np.asarray(result.residual)
+        for attr in self.attrs:
+            setattr(self, attr, getattr(result, attr, None))
+        # shared by shallow copies (split_result_by_group) so Parameters are only rebuilt once per group
+        self.__params = []
+
+    @classmethod
+    def from_arrays(cls, names, values, stderr, residual, **stats):
+        """Summary of a fit not run through lmfit (fit -batch); stats holds any of attrs"""
+        summary = cls.__new__(cls)
+        summary.names, summary.values, summary.stderr = list(names), np.asarray(values, dtype=float), list(stderr)
+        summary.residual = np.asarray(residual)
+        for attr in cls.attrs:
+            setattr(summary, attr, stats.get(attr))
+        summary.__params = []
+        return summary
+
+    def __copy__(self):
+        summary = FitSummary.__new__(FitSummary)
+        summary.__dict__.update(self.__dict__)
+        return summary
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_FitSummary__params'] = []
+        return state
+
+    @property
+    def params(self):
+        if len(self.__params) == 0:
+            params = Parameters()
+            for name, value, stderr in zip(self.names, self.values, self.stderr):
+                params.add(name, value=value, vary=False)
+                params[name].stderr = stderr
+            self.__params.append(params)
+        return self.__params[0]
+
+
+class FitCache(object):
+    """Bounded LRU cache of FitSummary results keyed by a hash of everything that determines a group's fit: data,
+    instrument response, model, parameter starting values, bounds, fix and link state, iteration limit and solver.
+    Owned by a toPyVuka.new_instance session and shared with its background fit jobs, so access is locked.
+    With a path the cache is loaded from and saved to that file"""
+    def __init__(self, maxsize=256, path=None):
+        self.__lock = threading.RLock()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.path = None
+        if path is not None:
+            self.set_path(path)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def key(plan, parameters, param_dict):
+        digest = hashlib.sha1()
+        for vectors in (plan.x, plan.y, plan.weights, plan.z, plan.ir_x, plan.ir_y, plan.ir_z):
+            for vec in vectors:
+                digest.update(b'|' if vec is None else np.ascontiguousarray(vec, dtype=float).tobytes() + b'|')
+        digest.update(repr([(model.fxn_index, model.expression) for model in plan.models]).encode())
+        digest.update(repr([(name, par.value, par.min, par.max, par.vary, par.expr)
+                            for name, par in parameters.items()]).encode())
+        digest.update(repr((sorted(plan.aliases.items()), [list(idx) for idx in plan.p_index],
+                            param_dict['max_iter'], param_dict['method'], param_dict['sparse'],
+                            param_dict.get('varpro', False), param_dict.get('multires'),
+                            param_dict.get('irf', False), param_dict.get('f32', False),
+                            param_dict.get('converge'))).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.__lock:
+            if key not in self.__entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return copy.copy(self.__entries[key])
+
+    def put(self, key, result):
+        with self.__lock:
+            if result is None or result.aborted:
+                return
+            self.__entries[key] = result if isinstance(result, FitSummary) else FitSummary(result)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.__lock:
+            return {'entries': len(self.__entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'path': self.path}
+
+    def set_path(self, path):
+        """Persists the cache to path, merging in entries already saved there"""
+        with self.__lock:
+            self.path = path
+            if path is not None and os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        saved = pickle.load(f)
+                    for key, result in saved.items():
+                        if key not in self.__entries:
+                            self.__entries[key] = result
+                    while len(self.__entries) > self.maxsize:
+                        self.__entries.popitem(last=False)
+                except Exception as e:
+                    print(f'Fit cache could not be loaded from {path}: {str(e)}')
+
+    def save(self):
+        with self.__lock:
+            if self.path is None:
+                return False
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.__entries, f)
+            os.replace(tmp, self.path)
+            return True
+
+
+class FitTelemetry(object):
+    """In-memory store of the per group records made by fit_group (see fit_telemetry), owned by a
+    toPyVuka.new_instance session.  Keeps the latest maxsize records; records() filters them, summary() totals
+    them per function or buffer, to_json() and to_csv() export them"""
+    FIELDS = ('fit', 'command', 'group', 'buffers', 'functions', 'npts', 'nfree', 'method', 'started', 'wall_time',
+              'nfev', 'njev', 'model_time', 'jacobian_time', 'solver_time', 'final_chisqr', 'success', 'aborted',
+              'stop_reason', 'worker', 'pid', 'refine_start', 'chisqr')
+
+    def __init__(self, maxsize=10000):
+        self.__lock = threading.RLock()
+        self.__records = deque(maxlen=maxsize)
+        self.__fits = 0
+
+    def __len__(self):
+        return len(self.__records)
+
+    def add(self, records, command=''):
+        """Stores the records of one fit command under a new fit number"""
+        with self.__lock:
+            self.__fits += 1
+            for record in records:
+                self.__records.append(dict(record, fit=self.__fits, command=command))
+            return self.__fits
+
+    def records(self, **filters):
+        """Copies of the stored records matching every filter, e.g. records(fit=3, worker='MainProcess').  The
+        buffers and functions fields match when they contain the value: records(buffers=12)"""
+        with self.__lock:
+            found = [record for record in self.__records
+                     if all(val in record.get(key, ()) if key in ('buffers', 'functions') else record.get(key) == val
+                            for key, val in filters.items())]
+            return copy.deepcopy(found)
+
+    def summary(self, by='function', **filters):
+        """Totals of groups, wall time, evaluations and time split per function index or buffer number, largest wall
+        time first.  A group's totals are divided evenly between the buffers it holds"""
+        if by not in ('function', 'buffer'):
+            raise ValueError("summary() groups by 'function' or 'buffer'")
+        totals = {}
+        for record in self.records(**filters):
+            keys = record['functions'] if by == 'function' else record['buffers']
+            share = 1 / max(len(keys), 1)
+            for key in keys:
+                total = totals.setdefault(key, {by: key, 'groups': 0, 'wall_time': 0.0, 'nfev': 0.0, 'njev': 0.0,
+                                                'model_time': 0.0, 'jacobian_time': 0.0, 'solver_time': 0.0})
+                total['groups'] += 1
+                for field in ('wall_time', 'nfev', 'njev', 'model_time', 'jacobian_time', 'solver_time'):
+                    total[field] += record[field] * share
+        return sorted(totals.values(), key=lambda total: -total['wall_time'])
+
+    def to_json(self, path=None, **filters):
+        text = json.dumps(self.records(**filters), indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_csv(self, path=None, **filters):
+        """One row per record; list fields are written space separated"""
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(self.FIELDS)
+        for record in self.records(**filters):
+            writer.writerow([' '.join(str(v) for v in record.get(field, [])) if isinstance(record.get(field), list)
+                             else record.get(field) for field in self.FIELDS])
+        if path is not None:
+            with open(path, 'w', newline='') as f:
+                f.write(out.getvalue())
+        return out.getvalue()
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+
+
+class SharedFitData(object):
+    """Stacks the x, y and weight vectors of every plan into one shared memory block so multiprocess fits do not
+    pickle them.  Workers attach read-only views with attach(); the creating process must call close()"""
+    def __init__(self, plan_vec):
+        self.layout = []
+        arrays = []
+        offset = 0
+        stacked = {}
+        for plan in plan_vec:
+            # groups repeated for replicate or profile tasks share one copy of their data
+            if id(plan) in stacked:
+                self.layout.append(stacked[id(plan)])
+                continue
+            group_layout = []
+            for i in range(len(plan.y)):
+                loc = []
+                for arr in (plan.x[i], plan.y[i], plan.weights[i]):
+                    if arr is None:
+                        loc.append(None)
+                        continue
+                    loc.append((offset, len(arr)))
+                    arrays.append((offset, arr))
+                    offset += len(arr)
+                group_layout.append(loc)
+            stacked[id(plan)] = group_layout
+            self.layout.append(group_layout)
+        self.size = max(offset, 1)
+        self.dtype = plan_vec[0].resid.dtype if len(plan_vec) > 0 else np.dtype(float)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.size * self.dtype.itemsize)
+        self.name = self.shm.name
+        data = np.ndarray((self.size,), dtype=self.dtype, buffer=self.shm.buf)
+        for start, arr in arrays:
+            data[start:start + len(arr)] = arr
+        del data
+
+    @staticmethod
+    def attach(name, size, dtype=float):
+        """Returns (SharedMemory, read-only view) for a block created in another process"""
+        shm = shared_memory.SharedMemory(name=name)
+        data = np.ndarray((size,), dtype=dtype, buffer=shm.buf)
+        data.flags.writeable = False
+        return shm, data
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        self.shm = None
+
+
+class FitCancelled(Exception):
+    """Raised from a fit progress callback (multi_fit, warm_fit, multistart_fit, batch_fit) to stop the fit"""
+    pass
+
+
+class FitPool(object):
+    """Long-lived worker pool for multi_fit, owned by a toPyVuka.new_instance session so repeated fits do not pay
+    process startup.  Workers start on first use and are only restarted when more are requested"""
+    def __init__(self):
+        self.__pool = None
+        self.size = 0
+
+    def get(self, cpu_num):
+        if self.__pool is None or self.size < cpu_num:
+            self.close()
+            if os.name == 'posix':
+                # workers must share the parent's resource tracker, or one exiting would unlink SharedFitData blocks
+                from multiprocessing import resource_tracker
+                resource_tracker.ensure_running()
+            self.__pool = mp.Pool(cpu_num)
+            self.size = cpu_num
+        return self.__pool
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+        self.__pool = None
+        self.size = 0
+
+    def __del__(self):
+        self.close()
+
+
+def chunk_param_dict(param_dict, idx_list, shared=None):
+    """Returns a copy of param_dict holding only the per-group entries of the groups in idx_list, so a worker
+    task pickles its own groups' data and nothing else.  'group_index' keeps the global group numbering.
+    With a SharedFitData block the raw vectors are left out and 'shm_block' tells the worker where to find them"""
+    ngroups = len(param_dict['plan_vec'])
+    chunk = {}
+    for key, val in param_dict.items():
+        if isinstance(val, list) and len(val) == ngroups:
+            chunk[key] = [val[idx] for idx in idx_list]
+        else:
+            chunk[key] = val
+    if 'group_index' not in param_dict:
+        chunk['group_index'] = list(idx_list)
+        chunk['total_groups'] = ngroups
+    if shared is not None:
+        for key in ('x_vec', 'y_vec', 'z_vec', 'ir_x_vec', 'ir_y_vec', 'ir_z_vec', 'weights_vec', 'y_matrix'):
+            chunk[key] = [None] * len(idx_list)
+        chunk['plan_vec'] = [plan.without_data() for plan in chunk['plan_vec']]
+        chunk['shm_block'] = (shared.name, shared.size, [shared.layout[idx] for idx in idx_list], shared.dtype)
+    return chunk
+
+
+def merge_param_dicts(param_dicts):
+    """Single param_dict holding the groups of every param_dict in order, e.g. one per candidate model of cmp, so
+    multi_fit schedules them as one task list.  Settings shared by all groups come from the first"""
+    ngroups = len(param_dicts[0]['plan_vec'])
+    merged = dict(param_dicts[0])
+    for key, val in merged.items():
+        if isinstance(val, list) and len(val) == ngroups:
+            merged[key] = [group for param_dict in param_dicts for group in param_dict[key]]
+    return merged
+
+
+def optimize_chunk(param_dict):
+    """Worker entry point: fits every group of a chunk built by chunk_param_dict"""
+    if param_dict.get('shm_block') is None:
+        return run_chunk(param_dict, [*range(len(param_dict['plan_vec']))])
+    name, size, layout, dtype = param_dict['shm_block']
+    shm, data = SharedFitData.attach(name, size, dtype)
+    try:
+        for plan, group_layout in zip(param_dict['plan_vec'], layout):
+            plan.attach(data, group_layout)
+        return [FitSummary(result) if isinstance(result, MinimizerResult) else result
+                for result in run_chunk(param_dict, [*range(len(param_dict['plan_vec']))])]
+    finally:
+        # views must be released before the block can be closed
+        for plan in param_dict['plan_vec']:
+            plan.x = plan.y = plan.weights = None
+        del data
+        shm.close()
+
+
+def multistart_points(parameters, nstart, rng):
+    """Returns nstart starting points for the free, unlinked parameters as {name: value} dicts.  The first is the
+    current values; the rest are a Latin hypercube over each parameter's bounds when both are finite (log-uniform
+    for positive bounds spanning more than three decades), otherwise over a box around the current value: two
+    decades either way for positive values, +/- max(|value|, 1) for the rest"""
+    names = [name for name, par in parameters.items() if par.vary and par.expr is None]
+    points = [{name: parameters[name].value for name in names} for _ in range(nstart)]
+    for name in names:
+        par = parameters[name]
+        lo, hi, log = par.min, par.max, False
+        if not (np.isfinite(lo) and np.isfinite(hi)):
+            if par.value > 0 and par.min >= 0:
+                lo, hi, log = max(par.value / 100, par.min), min(par.value * 100, par.max), True
+            else:
+                width = max(abs(par.value), 1)
+                lo, hi = max(par.value - width, par.min), min(par.value + width, par.max)
+        elif lo > 0 and hi / lo > 1E3:
+            log = True
+        # one sample per stratum, strata shuffled independently for each parameter
+        u = (rng.permutation(nstart - 1) + rng.random(nstart - 1)) / (nstart - 1)
+        samples = np.exp(np.log(lo) + u * (np.log(hi) - np.log(lo))) if log else lo + u * (hi - lo)
+        for point, value in zip(points[1:], samples):
+            point[name] = float(value)
+    return points
+
+
+def multistart_fit(param_dict, nstart, pool=None, progress=None):
+    """Fits every group from nstart starting points (see multistart_points) and keeps the lowest chi-square.
+    All starts of all groups run through multi_fit with a short evaluation budget of about five iterations; only
+    the best ceil(sqrt(nstart)) starts of each group are then fit to convergence.  progress(param_dict, [], []) is
+    called as the starts finish so a FitCancelled raised from it stops the fit; a group is only done once all of
+    its starts are, so results are reported by the caller.  Returns (results, report)"""
+    rng = np.random.default_rng(0)
+    ngroups = len(param_dict['plan_vec'])
+    starts = [multistart_points(param_dict['p_vec'][n], nstart, rng) for n in range(ngroups)]
+    nfree = max([len(points[0]) for points in starts])
+    short = int(min(param_dict['max_iter'], 5 * (nfree + 1)))
+
+    def expand(idx_list, points, max_nfev):
+        expanded = chunk_param_dict(param_dict, idx_list)
+        expanded['p_vec'] = []
+        for n, point in zip(idx_list, points):
+            parameters = copy.deepcopy(param_dict['p_vec'][n])
+            for name, value in point.items():
+                parameters[name].set(value=value)
+            expanded['p_vec'].append(parameters)
+        expanded['max_nfev'] = max_nfev
+        return expanded
+
+    def check(*args):
+        progress(param_dict, [], [])
+
+    stage_progress = None if progress is None else check
+
+    def chisqr(result, screening=False):
+        # screening fits stop at their budget, which lmfit reports as aborted
+        if (result.aborted and not screening) or result.chisqr is None or not np.isfinite(result.chisqr):
+            return np.inf
+        return result.chisqr
+
+    # stage 1: every start for a few iterations
+    idx_list = [n for n in range(ngroups) for _ in range(nstart)]
+    trial = multi_fit(expand(idx_list, [point for points in starts for point in points], short), pool, stage_progress)
+    keep = int(np.ceil(np.sqrt(nstart)))
+    survivors = []
+    for n in range(ngroups):
+        ranked = sorted(range(nstart), key=lambda k: chisqr(trial[n * nstart + k], screening=True))
+        survivors.extend([(n, k) for k in ranked[:keep]])
+
+    # stage 2: continue the survivors from where they stopped
+    points = []
+    for n, k in survivors:
+        params = trial[n * nstart + k].params
+        points.append({name: params[name].value for name in starts[n][k]})
+    final = multi_fit(expand([n for n, _ in survivors], points, None), pool, stage_progress)
+    results = [None] * ngroups
+    for (n, k), result in zip(survivors, final):
+        if results[n] is None or chisqr(result) < chisqr(results[n]):
+            results[n] = result
+            results[n].multistart = k
+
+    stage1 = sum([r.nfev for r in trial])
+    stage2 = sum([r.nfev for r in final])
+    moved = sum([1 for r in results if r.multistart != 0])
+    report = (f'Multi-start: {nstart} starts per group, {keep} continued; best start differed from the current values '
+              f'in {moved} of {ngroups} groups.  Function evaluations: {stage1} screening + {stage2} refinement')
+    return results, report
+
+
+def warm_fit(param_dict, progress=None):
+    """Fits groups one at a time, each seeded with the converged values of the most similar group already fit.
+    Groups are comparable when they use the same functions and data shape; similarity is the RMS distance between
+    their y vectors.  The next group fit is always the unfit group closest to any fitted one, so a concentration
+    series is walked neighbour to neighbour.  Only free, unlinked parameters are seeded.  Each result records the
+    group it was seeded from as warm_seed (None for a cold start).  progress(param_dict, [idx], [result]) is called
+    as each group finishes, as by multi_fit"""
+    plans = param_dict['plan_vec']
+    signature = [(tuple([(model.fxn_index, model.expression) for model in plan.models]),
+                  tuple([len(y) for y in plan.y])) for plan in plans]
+    curves = [np.concatenate(plan.y) for plan in plans]
+    best_dist = np.full(len(plans), np.inf)
+    best_seed = [None] * len(plans)
+    results = [None] * len(plans)
+    remaining = [*range(len(plans))]
+    while len(remaining) > 0:
+        nxt = remaining[int(np.argmin(best_dist[remaining]))]
+        remaining.remove(nxt)
+        seed = best_seed[nxt]
+        if seed is not None:
+            params = param_dict['p_vec'][nxt]
+            for names, seed_names in zip(param_dict['param_id_vec'][nxt], param_dict['param_id_vec'][seed]):
+                for name, seed_name in zip(names, seed_names):
+                    if name not in params or not params[name].vary or params[name].expr is not None:
+                        continue
+                    value = results[seed].params[seed_name].value
+                    if np.isfinite(value):
+                        params[name].set(value=float(np.clip(value, params[name].min, params[name].max)))
+        results[nxt] = optimizer(param_dict, [nxt])[0]
+        results[nxt].warm_seed = seed
+        if progress is not None:
+            progress(param_dict, [nxt], results[nxt:nxt + 1])
+        if results[nxt].aborted:
+            continue
+        for i in remaining:
+            if signature[i] == signature[nxt]:
+                dist = np.sqrt(np.nanmean((curves[i] - curves[nxt]) ** 2))
+                if dist < best_dist[i]:
+                    best_dist[i] = dist
+                    best_seed[i] = nxt
+    return results
+
+
+def warm_report(results):
+    """Summarizes the function evaluations of a warm_fit, for seeded groups and cold starts separately"""
+    cold = [r.nfev for r in results if r.warm_seed is None]
+    warm = [r.nfev for r in results if r.warm_seed is not None]
+    if len(warm) == 0:
+        return f'Warm start: no group could be seeded, {sum(cold)} function evaluations'
+    return (f'Warm start: {len(warm)} of {len(results)} groups seeded.  Function evaluations: {sum(warm)} for seeded '
+            f'groups (mean {np.mean(warm):.0f}), {sum(cold)} for cold starts (mean {np.mean(cold):.0f})')
+
+
+def optimize_task(task):
+    """Worker entry point for the dynamic scheduler: task is (task number, chunk)"""
+    return task[0], optimize_chunk(task[1])
+
+
+def multi_fit(param_dict, pool=None, progress=None):
     '''param_dict = {'x_vec': X_vec, 'y_vec': Y_vec, 'z_vec': Z_vec, 'p_vec':P_vec, 'y_matrix': Y_matrix,
                           'ir_x_vec': IR_X_vec, 'ir_y_vec': IR_Y_vec, 'ir_z_vec': IR_Z_vec,
                           'weights_vec': WEIGHTS_vec, 'fxn_vec': FXN_vec, 'fxn_num_vec': FXN_NUM_vec,
-                          'param_id_vec': PARAM_ID_vec,'method': method, 'debug': debug, 'group': group, 'cpu': cpu,
-                          'ind_fit': ind_fit, 'iter_cb': iter_cb, 'max_iter': max_iter}'''
+                          'model_vec': MODEL_vec, 'plan_vec': PLAN_vec, 'param_id_vec': PARAM_ID_vec,
+                          'method': method, 'debug': debug, 'group': group, 'cpu': cpu, 'ind_fit': ind_fit,
+                          'iter_cb': iter_cb, 'max_iter': max_iter, 'sparse': sparse, 'shm': shm}
+    pool is the session's FitPool; without one a temporary pool is created for this call.
+    progress(param_dict, idx_list, results) is called as groups finish; raising FitCancelled from it stops the fit'''
     idx_list = [*range(len(param_dict['x_vec']))]
-    func = partial(optimizer, param_dict)
-    cpu_num = int(min(mp.cpu_count() - 1, param_dict['cpu'], len(idx_list)))
-    group = param_dict['group']
-    seg_size = int(np.max([np.floor(np.floor(len(idx_list) / group) / cpu_num), 1]) * group)
-    # for global fitting group size needs to be taken into account for cpu usage (groups chunk together)
-    cpu_num = int(min(np.floor(len(idx_list) / seg_size), cpu_num))
+    cpu_num = int(min(max(mp.cpu_count() - 1, 1), param_dict['cpu'], len(idx_list)))
     results = []
     if cpu_num > 1:
-        seg_idx_list = [[]] * cpu_num
-        # fill multiproc chunks
-        for i in range(len(seg_idx_list)):
-            if i == len(seg_idx_list) - 1:
-                seg_idx_list[i] = idx_list[i * seg_size:]
+        # groups are handed out in small batches as workers free up, so one slow group only holds up its own batch
+        batch = max(int(np.ceil(len(idx_list) / (cpu_num * 16))), 1)
+        batches = [idx_list[i:i + batch] for i in range(0, len(idx_list), batch)]
+        # each task ships only its own groups; with -shm the data vectors go through shared memory instead
+        shared = SharedFitData([param_dict['plan_vec'][idx] for idx in idx_list]) if param_dict.get('shm') else None
+        proc_pool = None
+        try:
+            tasks = [(n, chunk_param_dict(param_dict, seg, shared)) for n, seg in enumerate(batches)]
+            if pool is None:
+                print(f'Generating Workers (cores:{cpu_num})...')
+                proc_pool = mp.Pool(cpu_num)
+                print('Fitting data in multiprocessing mode...')
+                workers = proc_pool
             else:
-                seg_idx_list[i] = idx_list[i * seg_size:(i + 1) * seg_size]
-
-        print(f'Generating Workers (cores:{cpu_num})...')
-        proc_pool = mp.Pool(cpu_num)
-        print('Fitting data in multiprocessing mode...')
-        results = proc_pool.map_async(func, seg_idx_list)
-        proc_pool.close()
-        proc_pool.join()
-        results = list(itertools.chain.from_iterable(results.get()))
-    else:  # Avoid multiprocessing overhead
+                print(f'Fitting data in multiprocessing mode (cores:{cpu_num})...')
+                workers = pool.get(cpu_num)
+            # tasks go out as workers free up, two per worker in flight, so cancelling only waits for those
+            done, waiting, finished, running = {}, deque(tasks), queue.SimpleQueue(), 0
+            try:
+                while len(done) < len(tasks):
+                    while len(waiting) > 0 and running < 2 * cpu_num:
+                        workers.apply_async(optimize_task, (waiting.popleft(),), callback=finished.put,
+                                            error_callback=finished.put)
+                        running += 1
+                    item = finished.get()
+                    running -= 1
+                    if isinstance(item, BaseException):
+                        raise item
+                    n, chunk_results = item
+                    done[n] = chunk_results
+                    if progress is not None:
+                        progress(param_dict, batches[n], chunk_results)
+            except FitCancelled:
+                # the rest of the job's tasks are never started; the session pool stays up for the next fit
+                if proc_pool is None:
+                    for _ in range(running):
+                        finished.get()
+                raise
+            if proc_pool is not None:
+                proc_pool.close()
+                proc_pool.join()
+            # reassemble in group order for split_result_by_group and saveparams
+            results = list(itertools.chain.from_iterable([done[n] for n in range(len(tasks))]))
+        except (KeyboardInterrupt, FitCancelled) as e:
+            # workers may still be attached to the shared block; stop them before it is unlinked
+            if proc_pool is not None:
+                proc_pool.terminate()
+                proc_pool.join()
+            if pool is not None and isinstance(e, KeyboardInterrupt):
+                pool.close()
+            raise
+        finally:
+            if shared is not None:
+                shared.close()
+    elif progress is None:  # Avoid multiprocessing overhead
         print(f'Fitting data in single core mode...')
-        results = [func([idx])[0] for idx in idx_list]
-    return results
\ No newline at end of file
+        results = run_chunk(param_dict, idx_list)
+    else:
+        print(f'Fitting data in single core mode...')
+        for idx in idx_list:
+            results.extend(run_chunk(param_dict, [idx]))
+            progress(param_dict, [idx], results[-1:])
+    return results
+
+
+def verify_precision(fxn_indices=None, npts=2000, seed=0):
+    """Harness for fit -f32: fits synthetic data from each bundled function (default parameters, 1% noise) from the
+    same perturbed start in double and single precision and compares the fitted parameters.  Returns a report
+    with, per function, the largest difference in units of the double precision standard error, the largest
+    difference relative to max(|value|, stderr) and both fit times.  Parameters the data do not determine (no
+    standard error) are counted but not compared; functions that can not be evaluated on a generic grid are
+    listed as skipped"""
+    # x ranges and fixed (experimental condition) parameters the defaults of some functions assume
+    grids = {14: (0, 8), 39: (0, 600), 40: (0, 600)}
+    fixed = {14: [6], 39: [0, 1, 2, 3, 7, 8, 9, 10], 40: [3, 4, 5, 6, 7]}
+    if fxn_indices is None:
+        fxn_indices = sorted(int(name[4:]) for name in dir(datafit) if re.fullmatch(r'fxn_\d+', name))
+    rng = np.random.default_rng(seed)
+    report = ['Function  Free  Undetermined  max|d|/stderr  max rel diff  f64 time (s)  f32 time (s)']
+    for fxn in fxn_indices:
+        fitparams = datafit(None)
+        fitparams.update([fxn])
+        model = compile_model([fxn])
+        x = np.linspace(*grids.get(fxn, (0.1, 10)), npts)
+        truth = np.array([v if v != 0 or n in fixed.get(fxn, []) else 0.5
+                          for n, v in enumerate(fitparams.paramdefaults)], dtype=float)
+        try:
+            y = model(x, truth)
+        except Exception:
+            y = np.full(npts, np.nan)
+        if not np.all(np.isfinite(y)):
+            report.append(f'{fxn:8d}  skipped (not evaluable on a generic grid)')
+            continue
+        y = y + rng.normal(0, 0.01 * (np.ptp(y) or max(abs(np.mean(y)), 1)), npts)
+        parameters = Parameters()
+        names = [f'{pid}_{n + 1}_1' for n, pid in enumerate(fitparams.paramid)]
+        for n, name in enumerate(names):
+            free = n not in fixed.get(fxn, [])
+            parameters.add(name, value=truth[n] * 1.2 if free else truth[n], vary=free,
+                           min=min(fitparams.parambounds[n]), max=max(fitparams.parambounds[n]))
+        results = {}
+        for dtype in (float, np.float32):
+            plan = EvalPlan(parameters, [names], [x], [y], [[]], [[]], [[]], [[]], [[]], [model])
+            plan = plan.as_dtype(dtype) if dtype != float else plan
+            param_dict = {'p_vec': [parameters], 'plan_vec': [plan], 'y_matrix': [None], 'iter_cb': None,
+                          'max_iter': 2000, 'method': 'leastsq', 'sparse': False}
+            results[dtype] = fit_group(param_dict, 0)
+        r64, r32 = results[float], results[np.float32]
+        free = [name for name in names if parameters[name].vary]
+        known = [name for name in free if r64.params[name].stderr is not None and r64.params[name].stderr > 0]
+        diff = {name: abs(r32.params[name].value - r64.params[name].value) for name in known}
+        sigma = max([diff[name] / r64.params[name].stderr for name in known], default=np.nan)
+        rel = max([diff[name] / max(abs(r64.params[name].value), r64.params[name].stderr) for name in known],
+                  default=np.nan)
+        report.append(f'{fxn:8d}  {len(free):4d}  {len(free) - len(known):12d}  {sigma:13.3g}  {rel:12.3g}  '
+                      f'{r64.fit_time:12.4f}  {r32.fit_time:12.4f}')
+    return '\n'.join(report)
@@ -18,6 +18,7 @@ def lambertw(val):
         w = np.log(val)
     if val > 3.0:
         w -= np.log(w)
+    last = np.inf
     while i < 20:  # Halley loop
         e = np.exp(w)
         t = w * e - val
@@ -25,11 +26,55 @@ def lambertw(val):
         w -= t
         if np.abs(t) < eps * (1.0 + np.abs(w)):
             return w  # rel - abs error
+        if last <= np.abs(t) < 1e-7 * (1.0 + np.abs(w)):
+            return w  # steps stopped shrinking at round-off, as they do near the branch point
+        last = np.abs(t)
         i += 1
     # never gets here
     return np.inf
 
 
+def lambertw_array(val):
+    """Array version of lambertw. All elements are iterated at once with a convergence mask.
+    Like lambertw, values below the -1/e branch point return -inf and values that do not converge return inf.
+    Single precision input (fit -f32) is iterated and returned in single precision"""
+    val = np.asarray(val)
+    val = val if val.dtype == np.float32 else np.asarray(val, dtype=float)
+    shape = val.shape
+    val = val.ravel()
+    eps = 4.0e-16 if val.dtype == float else 4 * float(np.finfo(val.dtype).eps)  #eps = desiredprecision
+    w = np.zeros(val.shape, dtype=val.dtype)
+    failed = val < -0.36787944117144232159552377016146086  # should return failure
+    active = ~failed & (val != 0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        #get initial approximation for iteration
+        series = active & (val < 1.0)  # series near 0
+        p = np.sqrt(2.0 * (2.7182818284590452353602874713526625 * val[series]+1.0))
+        w[series] = -1.0+p-p * p / 3.0+11.0 / 72.0 * p * p * p
+        asymptotic = active & ~(val < 1.0)
+        w[asymptotic] = np.log(val[asymptotic])
+        large = active & (val > 3.0)
+        w[large] -= np.log(w[large])
+        idx = np.flatnonzero(active)
+        last = np.full(idx.size, np.inf)
+        for i in range(20):  # Halley loop over unconverged elements only
+            if idx.size == 0:
+                break
+            wi = w[idx]
+            e = np.exp(wi)
+            t = wi * e - val[idx]
+            t /= e * (wi + 1.0) - 0.5 * (wi + 2.0) * t / (wi + 1.0)
+            wi -= t
+            w[idx] = wi
+            step = np.abs(t)
+            # rel - abs error, or steps stopped shrinking at round-off, as they do near the branch point
+            converged = (step < eps * (1.0 + np.abs(wi))) | ((last <= step) & (step < 1e-7 * (1.0 + np.abs(wi))))
+            idx, last = idx[~converged], step[~converged]
+    w[idx] = np.inf
+    w[failed] = -np.inf
+    return w[0] if len(shape) == 0 else w.reshape(shape)
+
+
 def calc_derivative(x_list, y_list):
     x_out = []
     y_out = []
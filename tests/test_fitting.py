@@ -0,0 +1,239 @@
+from types import SimpleNamespace
+import lmfit
+import numpy as np
+import pytest
+from PyVuka import fitfxns
+from PyVuka.ModuleLink import toPyVuka
+
+
+def gaussian_session(start):
+    """Session of one buffer holding a noisy gaussian (fxn 3) of width 40 at x=300, with fxn 3 started at start"""
+    pvk = toPyVuka.initialize_instance()
+    x = np.linspace(0.5, 600, 3000)
+    buffer = pvk.new_buffer()
+    buffer.data.x.set(x)
+    y = 1000 / (np.sqrt(2 * np.pi) * 40) * np.exp(-(x - 300) ** 2 / (2 * 40 ** 2))
+    buffer.data.y.set(y + np.random.default_rng(0).normal(0, 0.2, x.size))
+    pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command('fun 3 0')
+    pvk.run_pyvuka_command('ap -all ' + ' '.join(str(val) for val in start))
+    return pvk
+
+
+def test_multires_fallback_keeps_iteration_limit(monkeypatch):
+    budgets = []
+
+    def minimize(*args, **kwargs):
+        budgets.append(kwargs.get('max_nfev'))
+        if len(budgets) == 2:
+            # cut the refinement short so it aborts and falls back to the full fit budget
+            kwargs['max_nfev'] = 2
+        return lmfit.minimize(*args, **kwargs)
+
+    monkeypatch.setattr(fitfxns, 'minimize', minimize)
+    param_dict = fitfxns.datafit(gaussian_session([100, 5, 150])).build_fit('1', '-multires', '10')
+    result = fitfxns.fit_group(param_dict, 0)
+    # coarse pass, refinement on 10 * (nfree + 1) evaluations, then the fit 1 budget of 1 * (nfree + 1)
+    assert budgets == [None, 40, 4]
+    assert result.stop_reason == 'iteration limit'
+
+
+def test_uncertainty_resamples_around_best_fit():
+    pvk = toPyVuka.initialize_instance()
+    x = np.linspace(0, 100, 200)
+    buffer = pvk.new_buffer()
+    buffer.data.x.set(x)
+    buffer.data.y.set(2.5 * x + 10 + np.random.default_rng(1).normal(0, 1, x.size))
+    pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command('fun 27 0')
+    # start far from the fit: unc refits before resampling
+    pvk.run_pyvuka_command('ap -all -1 300')
+    pvk.run_pyvuka_command('unc -n 20 -silent')
+    (slope_low, slope, slope_high), (icpt_low, icpt, icpt_high) = pvk.data.matrix.buffer(1).fit.parameter_percentiles.get()
+    assert slope_low < 2.5 < slope_high and slope_high - slope_low < 0.05
+    assert icpt_low < 10 < icpt_high and icpt_high - icpt_low < 1
+
+
+def test_model_command_reconvolves_irf_fits():
+    pvk = toPyVuka.initialize_instance()
+    x = np.arange(0, 50, 0.1)
+    irf = np.exp(-(x - 2) ** 2 / (2 * 0.3 ** 2))
+    decay = 100 * np.exp(-x / 5)
+    buffer = pvk.new_buffer()
+    buffer.data.x.set(x)
+    buffer.data.y.set(np.convolve(decay, irf / np.sum(irf))[:x.size])
+    buffer.instrument_response.x.set(x)
+    buffer.instrument_response.y.set(irf)
+    pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command('fun 2 0')
+    pvk.run_pyvuka_command('ap -all 80 3')
+    pvk.run_pyvuka_command('fit 2000 -irf')
+    buffer = pvk.data.matrix.buffer(1)
+    fitted = buffer.residuals.y.get().copy()
+    assert np.max(np.abs(fitted)) < 1E-6
+    pvk.run_pyvuka_command('mod -all')
+    assert np.allclose(buffer.residuals.y.get(), fitted, atol=1E-9)
+
+
+def kinetics_session(nbuf=6, npts=600):
+    """Session of nbuf noisy 1:1 binding traces (fxn 40) at increasing concentration, started off the true
+    Rmax, kd and ka with Cp, m, X0 and kds fixed"""
+    pvk = toPyVuka.initialize_instance()
+    x = np.linspace(0.5, 600, npts)
+    model = fitfxns.compile_model((40,))
+    rng = np.random.default_rng(2)
+    for b in range(nbuf):
+        buffer = pvk.new_buffer()
+        buffer.data.x.set(x)
+        buffer.data.y.set(model(x, np.array([25, 0.001, 60000, 1E-7 * (b + 1), 0, 0, 180, 1]))
+                          + rng.normal(0, 0.1, x.size))
+        pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command('fun 40 0')
+    pvk.run_pyvuka_command('ap -all 22 0.0012 55000 1E-7 0 0 180 1')
+    for n in (4, 5, 7, 8):
+        pvk.run_pyvuka_command(f'fix {n}')
+    return pvk
+
+
+def fit_state(pvk):
+    """Parameters, standard errors and residuals of every buffer"""
+    buffers = [pvk.data.matrix.buffer(i) for i in range(1, pvk.data.matrix.length() + 1)]
+    return (np.array([b.fit.parameter.get() for b in buffers], dtype=float),
+            np.array([b.fit.parameter_error.get() for b in buffers], dtype=float),
+            np.array([b.residuals.y.get() for b in buffers], dtype=float))
+
+
+def test_batch_matches_independent_fits():
+    batch = kinetics_session()
+    batch.run_pyvuka_command('fit 2000 -ind -batch -silent')
+    assert {record['method'] for record in batch.get_fit_telemetry()} == {'batch'}
+    single = kinetics_session()
+    single.run_pyvuka_command('fit 2000 -ind -silent')
+    (p_batch, err_batch, resid_batch), (p, err, resid) = fit_state(batch), fit_state(single)
+    assert np.allclose(p_batch, p, rtol=1E-5, atol=0)
+    assert np.allclose(err_batch, err, rtol=1E-3, atol=0)
+    assert np.allclose(resid_batch, resid, rtol=0, atol=1E-5)
+
+
+def test_batch_f32_evaluates_in_double_precision():
+    runs = []
+    for flags in ('-batch', '-f32 -batch'):
+        pvk = kinetics_session()
+        pvk.run_pyvuka_command(f'fit 2000 -ind -silent {flags}')
+        runs.append(([record['nfev'] for record in pvk.get_fit_telemetry()], fit_state(pvk)[0]))
+    (nfev, p), (nfev_f32, p_f32) = runs
+    assert nfev_f32 == nfev
+    assert np.array_equal(p_f32, p)
+
+
+def test_batch_falls_back_when_incompatible(monkeypatch):
+    reasons = []
+
+    def batch_fit(param_dict, **kwargs):
+        reasons.append(fitfxns.batch_incompatible(param_dict))
+        return batch_fit_stacked(param_dict, **kwargs)
+
+    batch_fit_stacked = fitfxns.batch_fit
+    monkeypatch.setattr(fitfxns, 'batch_fit', batch_fit)
+
+    def fits(pvk, command='fit 2000 -ind -batch -silent'):
+        message = pvk.run_pyvuka_command(command)
+        assert message.strip() == 'Independent Fitting Complete!'
+        assert {record['method'] for record in pvk.get_fit_telemetry()} == {'Leastsq'}
+
+    pvk = kinetics_session()
+    buffer = pvk.data.matrix.buffer(6)
+    buffer.fit.function_index.set([27])
+    buffer.fit.function.set('(P[0]*X)+P[1]')
+    buffer.fit.parameter.set([0.0, 1.0])
+    buffer.fit.free.set([True, True])
+    buffer.fit.link.set([None, None])
+    fits(pvk)
+
+    pvk = kinetics_session()
+    buffer = pvk.data.matrix.buffer(6)
+    buffer.data.x.set(buffer.data.x.get()[:500])
+    buffer.data.y.set(buffer.data.y.get()[:500])
+    fits(pvk)
+
+    pvk = kinetics_session()
+    for i in range(1, 7):
+        buffer = pvk.data.matrix.buffer(i)
+        buffer.instrument_response.x.set(buffer.data.x.get())
+        buffer.instrument_response.y.set(np.exp(-(buffer.data.x.get() - 2) ** 2))
+    fits(pvk, 'fit 2000 -ind -batch -irf -silent')
+
+    # fit -ind drops links before fitting, so linked parameters only reach the batch fit through dofit
+    pvk = kinetics_session()
+    for i in range(1, 7):
+        pvk.data.matrix.buffer(i).fit.link.set([None] * 5 + [f'm_5_{i}', None, None])
+    assert fitfxns.datafit(pvk).dofit('2000', '-ind', '-batch', '-silent').endswith('Fitting Complete!')
+
+    assert reasons == ['buffers use different functions or -irf', 'buffers differ in length',
+                       'buffers use different functions or -irf', 'parameters are linked']
+
+
+
+def test_warm_fit_reports_evaluations_used(capsys):
+    pvk = kinetics_session(nbuf=4)
+    pvk.run_pyvuka_command('fit 2000 -ind -warm -cpu 2')
+    out = capsys.readouterr().out
+    assert 'Warm start fits groups one after another, -cpu ignored' in out
+    assert 'Warm start: 3 of 4 groups seeded.' in out and 'saved' not in out
+    results = [SimpleNamespace(nfev=nfev, warm_seed=seed) for nfev, seed in [(40, None), (12, 0), (20, 1), (30, None)]]
+    assert fitfxns.warm_report(results) == ('Warm start: 2 of 4 groups seeded.  Function evaluations: 32 for seeded '
+                                            'groups (mean 16), 70 for cold starts (mean 35)')
+
+
+def test_group_residuals_split_around_dropped_nans():
+    pvk = toPyVuka.initialize_instance()
+    rng = np.random.default_rng(4)
+    for npts in (30, 50):
+        x = np.linspace(0, 10, npts)
+        y = 2 * x + 1 + rng.normal(0, 0.1, npts)
+        if npts == 30:
+            y[5] = np.nan
+        buffer = pvk.new_buffer()
+        buffer.data.x.set(x)
+        buffer.data.y.set(y)
+        pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command('fun 27 0')
+    pvk.run_pyvuka_command('ap -all 1 0')
+    pvk.run_pyvuka_command('fit 2000 -group 2 -silent')
+    for i in (1, 2):
+        buffer = pvk.data.matrix.buffer(i)
+        slope, icpt = buffer.fit.parameter.get()
+        expected = buffer.data.y.get() - (slope * buffer.data.x.get() + icpt)
+        resid = buffer.residuals.y.get()
+        assert len(resid) == len(expected)
+        assert np.array_equal(np.isnan(resid), np.isnan(expected))
+        assert np.allclose(resid[~np.isnan(resid)], expected[~np.isnan(expected)], rtol=0, atol=1E-9)
+
+
+@pytest.mark.parametrize('fxn, start', [(27, [-1, 300]), (30, [-1])])
+def test_varpro_projects_linear_functions(monkeypatch, fxn, start):
+    projected = []
+
+    def varpro_fit(*args):
+        projected.append(varpro_fit_projected(*args))
+        return projected[-1]
+
+    varpro_fit_projected = fitfxns.varpro_fit
+    monkeypatch.setattr(fitfxns, 'varpro_fit', varpro_fit)
+    fits = []
+    for flags in ('-varpro', ''):
+        pvk = toPyVuka.initialize_instance()
+        x = np.linspace(0, 100, 200)
+        buffer = pvk.new_buffer()
+        buffer.data.x.set(x)
+        buffer.data.y.set(2.5 * x + (10 if fxn == 27 else 0) + np.random.default_rng(1).normal(0, 1, x.size))
+        pvk.add_buffer_to_datamatrix(buffer)
+        pvk.run_pyvuka_command(f'fun {fxn} 0')
+        buffer.fit.parameter.set(list(start))
+        buffer.fit.free.set([True] * len(start))
+        buffer.fit.link.set([None] * len(start))
+        pvk.run_pyvuka_command(f'fit 2000 -silent {flags}')
+        fits.append(pvk.data.matrix.buffer(1).fit.parameter.get())
+    # every parameter is linear: the projection alone is the fit
+    assert len(projected) == 1 and projected[0] is not None
+    assert np.allclose(fits[0], fits[1], rtol=1E-6, atol=0)
@@ -0,0 +1,66 @@
+import sys
+import numpy as np
+import pytest
+from PyVuka import fitfxns
+from test_fitting import kinetics_session
+
+
+def test_job_output_leaves_sys_stdout(capsys):
+    pvk = kinetics_session(nbuf=2)
+    stdout = sys.stdout
+    job = pvk.submit_fit(fit_options='2000 -ind')
+    print('printed while the job runs')
+    job.result()
+    assert sys.stdout is stdout
+    assert 'printed while the job runs' in capsys.readouterr().out
+    assert 'Fitting Complete!' in job.log
+    pvk.close()
+    assert sys.stdout is stdout
+
+
+@pytest.mark.parametrize('flags', ['-warm', '-multistart 4', '-batch'])
+def test_job_reports_progress(flags):
+    pvk = kinetics_session(nbuf=3)
+    job = pvk.submit_fit(fit_options=f'2000 -ind -silent {flags}')
+    job.result()
+    assert job.progress == (3, 3)
+    assert sorted(job.partial_results()) == [1, 2, 3]
+    pvk.close()
+
+
+@pytest.mark.parametrize('flags', ['-warm', '-multistart 4', '-batch'])
+def test_progress_callback_cancels(flags):
+    pvk = kinetics_session(nbuf=3)
+    calls = []
+
+    def progress(param_dict, idx_list, results):
+        calls.append(list(idx_list))
+        raise fitfxns.FitCancelled()
+
+    pvk.fit_progress = progress
+    before = pvk.data.matrix.buffer(1).fit.parameter.get().copy()
+    with pytest.raises(fitfxns.FitCancelled):
+        fitfxns.datafit(pvk).dofit('2000', '-ind', '-silent', *flags.split())
+    # stopped during the fit, not once every group had finished
+    assert len(calls) == 1 and len(calls[0]) < 3
+    assert np.array_equal(pvk.data.matrix.buffer(1).fit.parameter.get(), before)
+
+
+def test_cancel_leaves_session_pool_running(monkeypatch):
+    monkeypatch.setattr(fitfxns.mp, 'cpu_count', lambda: 3)
+    pvk = kinetics_session(nbuf=4)
+    pool = fitfxns.FitPool()
+    pvk.fit_pool = pool
+
+    def progress(param_dict, idx_list, results):
+        raise fitfxns.FitCancelled()
+
+    pvk.fit_progress = progress
+    workers = pool.get(2)
+    with pytest.raises(fitfxns.FitCancelled):
+        fitfxns.datafit(pvk).dofit('2000', '-ind', '-silent', '-cpu', '2')
+    assert pool.get(2) is workers
+    del pvk.fit_progress
+    assert fitfxns.datafit(pvk).dofit('2000', '-ind', '-silent', '-cpu', '2').endswith('Fitting Complete!')
+    assert pool.get(2) is workers
+    pool.close()
@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+import scipy.special
+from PyVuka import fitfxns
+from PyVuka import numericalmethods
+
+BRANCH = -1 / np.e
+
+
+def cfca_loop(X, P):
+    """fxn_39 as the scalar per-point loop it was written as, on numericalmethods.lambertw"""
+    P = [float(p) for p in P]
+    SpotL, L1 = .16, .03
+    L2 = L1 + SpotL
+    CW, CH = 0.05, 0.005
+    CKC = 1.47 * ((1 - np.power((L1 / L2), 0.6666666667)) / (1 - (L1 / L2)))
+    D = (1.381E-23 * (298.15 + P[3])) / (6 * np.pi * np.power((3 * np.pi * P[2] * (7.3E-4 / (4 * np.pi * 6.022E23))),
+                                                                0.3333333333) * 0.001 * 1.2)
+    P[7] = P[7] / P[0]
+    P[1] = P[1] * 60
+    P[3] = P[3] + 273.15
+    if P[9] == 0:
+        P[9] = CKC * np.power((((D * D) * P[1]) / (np.power(CH, 2) * CW * L2)), 0.3333333333)
+    K1 = (P[7] * P[5]) / ((P[7] * P[5]) + P[6])
+    K2 = (P[7] * np.power(P[5], 2) * P[4]) / ((((P[7] * P[5]) + P[6]) * P[9] * P[2] * P[10]) + (P[5] * P[6] * P[4]))
+    K3 = (np.power(((P[7] * P[5]) + P[6]), 2) * P[9] * P[2] * P[10]) / (
+        P[6] * ((((P[7] * P[5]) + P[6]) * (P[9] * P[2] * P[10])) + (P[5] * P[6] * P[4])))
+    K5 = (P[2] * P[10] * P[9]) / ((P[2] * P[10] * P[9]) + (P[5] * P[4]))
+    K6 = ((P[2] * P[10] * P[9]) + (P[5] * P[4])) / P[5]
+    R = np.zeros(len(X))
+    Rz = None
+    for j in range(len(X)):
+        if X[j] <= P[8]:
+            Wval = numericalmethods.lambertw(K2 * np.exp(K2 - (K3 * P[6] * X[j])))
+            R[j] = P[4] * K1 * (1 - (Wval / K2))
+            Rz = float(R[j])
+        else:
+            Wval = numericalmethods.lambertw(((-1 * Rz) / K6) * np.exp(-1 * ((Rz / K6) + (K5 * P[6] * (X[j] - P[8])))))
+            R[j] = (-1 * K6) * Wval
+    return R
+
+
+def one_to_one_loop(X, P):
+    """fxn_40 as the scalar per-point loop it was written as"""
+    rm, kd, ka, cp, m, c, xo, kds = P
+    if cp == 0:
+        cp = 1E-15
+    R = np.zeros(len(X))
+    for j in range(len(X)):
+        if X[j] <= xo:
+            R[j] = (rm / (1 + (kd / (ka * cp)))) * (1 - (np.exp((-1 * X[j] * ((ka * cp) + kd)))))
+        else:
+            R[j] = kds * (((rm / (1 + (kd / (ka * cp)))) * (1 - np.exp(-1 * xo * (ka * cp + kd))) - c)) * \
+                (np.exp(-1 * kd * (X[j] - xo))) + m * (X[j] - xo) + c
+    return R
+
+
+def random_params(fxn, rng, n):
+    """n parameter sets of fxn: rates, concentration and amplitude spread over two decades around the defaults,
+    phase boundary anywhere in the trace"""
+    fitparams = fitfxns.datafit(None)
+    fitparams.update([fxn])
+    scaled = {39: [4, 5, 6, 7, 9], 40: [0, 1, 2, 3]}[fxn]
+    sets = []
+    for _ in range(n):
+        P = np.array(fitparams.paramdefaults, dtype=float)
+        P[scaled] *= 10 ** rng.uniform(-1, 1, len(scaled))
+        P[{39: 8, 40: 6}[fxn]] = rng.uniform(50, 550)
+        if fxn == 39:
+            P[9] = rng.choice([0, 10 ** rng.uniform(-6, -3)])
+        else:
+            P[[4, 5, 7]] = rng.uniform(-0.01, 0.01), rng.uniform(-5, 5), rng.uniform(0.5, 2)
+        sets.append(P)
+    return sets
+
+
+@pytest.mark.parametrize('fxn, reference', [(39, cfca_loop), (40, one_to_one_loop)])
+def test_vectorized_models_match_scalar_loops(fxn, reference):
+    model = fitfxns.compile_model((fxn,))
+    X = np.linspace(0.5, 600, 600)
+    for P in random_params(fxn, np.random.default_rng(fxn), 25):
+        expected = reference(X, P)
+        R = model(X, P.copy())
+        assert np.allclose(R, expected, rtol=1E-12, atol=1E-12 * np.max(np.abs(expected))), P
+
+
+def test_cfca_near_branch_point():
+    # near saturated associations start dissociation at Rz ~ K6, where the Lambert W argument
+    # -Rz/K6 * exp(-Rz/K6) lies 2E-4, 2E-6 and 1E-6 above -1/e
+    X = np.linspace(0.5, 600, 600)
+    model = fitfxns.compile_model((39,))
+    for kd, Ca, kc, G in [(1E-3, 5E-8, 1E-3, 1E5), (1E-3, 5E-7, 1E-3, 1E4), (1E-5, 5E-6, 1E-3, 1E4)]:
+        P = np.array([1, 30, 14300, 25, 25, 2.3E6, kd, Ca, 500, kc, G])
+        expected = cfca_loop(X, P)
+        R = model(X, P.copy())
+        assert np.all(np.isfinite(R))
+        assert np.allclose(R, expected, rtol=1E-10, atol=1E-10 * np.max(np.abs(expected)))
+
+
+def test_lambertw_array_matches_scalar():
+    val = np.concatenate([
+        [BRANCH - 1E-3, BRANCH - 1E-12, BRANCH, BRANCH + 1E-15, BRANCH + 1E-12, BRANCH + 1E-8, BRANCH + 1E-4],
+        # Halley steps cycle at round-off here instead of meeting the 4E-16 tolerance
+        [-0.36764370511712413, -0.3676347765077714],
+        [-0.3, -1E-10, 0.0, 1E-300, 1E-10, 1.0, 3.0, np.e, 1E3, 1E300],
+        np.random.default_rng(3).uniform(BRANCH, 50, 200)])
+    w = numericalmethods.lambertw_array(val)
+    expected = np.array([numericalmethods.lambertw(v) for v in val])
+    assert np.array_equal(np.isinf(w), np.isinf(expected))
+    finite = np.isfinite(expected)
+    assert np.allclose(w[finite], expected[finite], rtol=1E-14, atol=1E-14)
+    assert np.all(w[val < BRANCH] == -np.inf)
+    # and both are the principal branch, to the sqrt(eps) conditioning of W at the branch point
+    assert np.all(np.isfinite(w[val >= BRANCH]))
+    above = val > BRANCH
+    assert np.allclose(w[above], scipy.special.lambertw(val[above]).real, rtol=1E-7, atol=1E-300)
+    assert numericalmethods.lambertw_array(0.5) == pytest.approx(numericalmethods.lambertw(0.5), rel=1E-15)
+
+
+def central_differences(model, X, P):
+    J = np.zeros((len(P), len(X)))
+    for n in range(len(P)):
+        h = 1E-6 * abs(P[n]) if P[n] != 0 else 1E-6
+        up, down = P.copy(), P.copy()
+        up[n] += h
+        down[n] -= h
+        J[n] = (model(X, up) - model(X, down)) / (2 * h)
+    return J
+
+
+@pytest.mark.parametrize('fxn, X, P', [
+    ((1,), np.linspace(0, 10, 50), [3]),
+    ((2,), np.linspace(0.1, 10, 50), [5, 2]),
+    ((3,), np.linspace(-10, 20, 50), [10, 5, 5]),
+    ((14,), np.linspace(0, 8, 50), [5, 1.8, 100, 2000, -5, 10, 298.15]),
+    ((27,), np.linspace(-5, 5, 50), [2, -1]),
+    ((30,), np.linspace(-5, 5, 50), [1.5]),
+    # masked association/dissociation pyjacobian
+    ((40,), np.linspace(0.5, 600, 600), [25, 0.001, 60000, 1E-7, 0.002, 1.5, 180, 1.2]),
+    ((41,), np.logspace(-1, 2, 50), [5, 1.2, 2, 100]),
+    ((42,), np.linspace(1, 500, 50), [20, 100, 1000, 5]),
+    ((43,), np.linspace(0.1, 10, 50), [0.5, 1000, 3]),
+    # summed functions take their derivatives at offset parameter indices
+    ((2, 2), np.linspace(0.1, 10, 50), [5, 2, 1, 0.3]),
+    ((27, 3), np.linspace(-10, 20, 50), [0.5, 1, 10, 5, 5])])
+def test_declared_derivatives_match_finite_differences(fxn, X, P):
+    model = fitfxns.compile_model(fxn)
+    P = np.array(P, dtype=float)
+    assert model.has_jacobian
+    J = model.jacobian(X, P.copy())
+    expected = central_differences(model, X, P)
+    # each parameter's column to 1E-6 of its largest value
+    scale = np.max(np.abs(expected), axis=1, keepdims=True)
+    assert np.all(np.abs(J - expected) <= 1E-6 * scale)
+
+
+def test_reconvolved_jacobian_matches_finite_differences():
+    X = np.linspace(0, 20, 200)
+    model = fitfxns.ReconvolvedModel(fitfxns.compile_model((2,)), X, X, np.exp(-(X - 1) ** 2 / 0.1))
+    P = np.array([5.0, 2.0])
+    expected = central_differences(model, X, P)
+    scale = np.max(np.abs(expected), axis=1, keepdims=True)
+    assert np.all(np.abs(model.jacobian(X, P.copy()) - expected) <= 1E-6 * scale)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PyVuka import fitfxns
+from PyVuka.ModuleLink import toPyVuka
+
+
+def session(fxn, nbuf=2, npts=300):
+    """Session of nbuf buffers on 0.5..600 holding the model of fxn at its default parameters"""
+    pvk = toPyVuka.initialize_instance()
+    fitparams = fitfxns.datafit(None)
+    fitparams.update([fxn])
+    x = np.linspace(0.5, 600, npts)
+    y = fitfxns.compile_model((fxn,))(x, np.array(fitparams.paramdefaults, dtype=float))
+    for _ in range(nbuf):
+        buffer = pvk.new_buffer()
+        buffer.data.x.set(x)
+        buffer.data.y.set(y)
+        pvk.add_buffer_to_datamatrix(buffer)
+    pvk.run_pyvuka_command(f'fun {fxn} 0')
+    pvk.run_pyvuka_command('ap -all ' + ' '.join(str(val) for val in fitparams.paramdefaults))
+    return pvk
+
+
+@pytest.mark.parametrize('fxn', [39, 40, 41])
+def test_f32_models_evaluate_in_single_precision(fxn):
+    param_dict = fitfxns.datafit(session(fxn)).build_fit('2000', '-f32')
+    plan = param_dict['plan_vec'][0]
+    values = plan.values(param_dict['p_vec'][0])
+    for i, model in enumerate(plan.models):
+        x = plan.x[i]
+        assert x.dtype == np.float32
+        P = values[plan.p_index[i]]
+        R = model(x, P.astype(np.float32), plan.y[i], plan.z[i], plan.ir_x[i], plan.ir_y[i], plan.ir_z[i])
+        assert R.dtype == np.float32
+        R64 = model(x.astype(float), P, plan.y[i], plan.z[i], plan.ir_x[i], plan.ir_y[i], plan.ir_z[i])
+        assert np.allclose(R, R64, rtol=1E-4, atol=1E-4 * np.max(np.abs(R64)))
+        J = model.jacobian(x, P.astype(np.float32))
+        assert J is None or J.dtype == np.float32
+    # the residual handed to the optimizer stays double precision
+    assert plan(param_dict['p_vec'][0]).dtype == float
+
+
+def test_lambertw_array_keeps_single_precision():
+    from PyVuka import numericalmethods
+    val = np.array([-0.3, 0.0, 0.5, 10.0, 1E4], dtype=np.float32)
+    w = numericalmethods.lambertw_array(val)
+    assert w.dtype == np.float32
+    assert np.allclose(w * np.exp(w), val, rtol=1E-5, atol=1E-6)